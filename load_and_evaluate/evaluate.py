@@ -4,13 +4,21 @@ import glob
 import os
 import importlib.util
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from utility.util_es import get_es
-from utility.util_llm import LLMUtil
+from utility.util_es import get_es, msearch_ranked_ids, warm_search_to_context, DEFAULT_SEARCH_SIZE
+from utility.util_llm import LLMUtil, LLMError, RAG_PROMPT_TEMPLATE, RAG_MODEL
+from utility.util_llm_rag_cache import answer_version
 from utility.util_deep_eval import generateLLMTestCase, evaluateTestCases
+from utility.util_pipeline import AsyncPipeline, Stage
+from utility.util_metrics import relevance_matrix, score_rankings
+from utility.util_eval_store import EvalResultStore
+from utility.util_cache import cache_stats, print_cache_stats
+from utility.util_query_transform_cache import transform_queries
+from utility.util_semantic_cache import SemanticAnswerCache
 
 from deepeval.evaluate import TestResult
 
@@ -19,8 +27,49 @@ llm_util = LLMUtil(openai_api_key)
 
 
 OUTPUT_CSV = "search_evaluation_results.csv"
+METRICS_CSV = "search_evaluation_metrics.csv"  # per-strategy averages of every local metric
 STRATEGIES_FOLDER = "strategies"       # Folder containing *.py strategy files
 GOLDEN_DATA_CSV = "golden_data.csv"    # CSV with columns: query, best_ids, natural_answer (or similar)
+RANK_EVAL_WORKERS = 8                  # _rank_eval requests in flight at once (shares the pooled ES client)
+RANK_EVAL_CHUNK_SIZE = 100             # golden queries sent per _rank_eval request
+EVALUATION_MODE = "rank_eval"          # "rank_eval": server side _rank_eval | "local": one _msearch pass scored client side
+LOCAL_METRIC_KS = [1, 3, 5, 10]        # cutoffs for nDCG / precision / recall in local mode
+PRIMARY_LOCAL_METRIC = "ndcg@10"       # local metric written to OUTPUT_CSV, same as the _rank_eval dcg metric
+RANK_EVAL_METRIC = {                   # metric block of every _rank_eval request
+    "dcg": {
+        "k": 10,
+        "normalize": True
+    }
+    # "recall": {
+    #     "k": 10,
+    #     "relevant_rating_threshold": 1
+    # }
+}
+INCREMENTAL_EVAL = True                # only re-run strategy/query pairs whose inputs changed since the last run
+EVAL_STORE_PATH = "evaluation_store.json"
+RANK_EVAL_HELPERS = [                  # retrieval code outside the strategy files, part of every rank / local eval result key
+    "utility/util_es.py",
+    "utility/util_retrieval_cache.py",
+    "utility/util_query_transform_cache.py",
+]
+LOCAL_EVAL_HELPERS = RANK_EVAL_HELPERS + ["utility/util_metrics.py"]
+DEEP_EVAL_HELPERS = RANK_EVAL_HELPERS + [  # plus judge setup, RAG prompt / model and context packing
+    "utility/util_deep_eval.py",
+    "utility/util_llm.py",
+    "utility/util_context_pack.py",
+]
+DEEP_EVAL_CONCURRENCY = {              # workers per deep eval pipeline stage
+    "transform": 8,
+    "retrieve": 8,
+    "generate": 8,
+    "judge": 1,                        # deepeval runs its metrics concurrently within a batch
+}
+DEEP_EVAL_JUDGE_BATCH_SIZE = 20        # max test cases handed to deepeval per judge call
+DEEP_EVAL_QUEUE_SIZE = 100             # max items waiting in front of each stage
+CACHE_STATS_JSON = "cache_stats.json"  # hit / miss / eviction counters of the LLM caches for this run
+WARM_QUERY_TRANSFORMS = True          # rewrite the golden questions in batched LLM calls before the evaluation phases
+WARM_RETRIEVALS = True                 # fetch the deep eval retrievals in one _msearch per chunk before the pipeline
+SEMANTIC_CACHE = False                 # answer near-duplicate questions of a strategy from utility/util_semantic_cache.py
 
 
 def load_strategies(folder_path):
@@ -75,23 +124,78 @@ def load_golden_data(csv_path):
     return data
 
 
-def build_rank_eval_request(golden_data, strategy_module):
+def warm_query_transforms(golden_data, strategy_modules):
+    """
+    Fill the query transform cache for every strategy with a query_transform,
+    batching the golden questions per transform prompt, so the evaluation
+    phases only get cache hits.
+    """
+    prompts = {
+        module.get_parameters()["query_transform_prompt"]
+        for module in strategy_modules.values() if hasattr(module, "query_transform")
+    }
+    questions = [item["query"] for item in golden_data]
+    for prompt in prompts:
+        try:
+            transform_queries(questions, prompt, llm_util)
+        except LLMError as e:
+            ## the evaluation phases retry whatever is still missing one by one
+            print(f"Error warming query transforms: {e}")
+
+
+def warm_retrieval_cache(es, golden_data, strategy_modules, strategy_rows=None,
+                         max_workers=RANK_EVAL_WORKERS, chunk_size=RANK_EVAL_CHUNK_SIZE):
+    """
+    Fetch the RAG retrievals of the deep eval cases up front, one _msearch
+    per chunk of a strategy's golden rows, so the retrieve stage reads them
+    from the retrieval cache. _rank_eval runs server side and can't fill
+    that cache, so without this every case would search on its own.
+    """
+    def warm_chunk(strategy_name, module, rows):
+        parameters = module.get_parameters()
+        try:
+            warm_search_to_context(es, parameters["index_name"],
+                                   [build_strategy_query(module, golden_data[i]["query"]) for i in rows],
+                                   parameters.get("rag_context", "lore"), DEFAULT_SEARCH_SIZE,
+                                   parameters.get("rag_context_mode", "document"))
+        except Exception as e:
+            ## the retrieve stage searches whatever is still missing one by one
+            print(f"Error warming retrievals for strategy {strategy_name}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for strategy_name, module in strategy_modules.items():
+            rows = strategy_rows[strategy_name] if strategy_rows is not None else list(range(len(golden_data)))
+            for chunk in chunk_rows(rows, chunk_size):
+                executor.submit(warm_chunk, strategy_name, module, chunk)
+
+
+def build_strategy_query(strategy_module, query: str) -> dict:
+    """
+    Apply the strategy's optional query_transform and return its query DSL.
+    """
+    query_string = strategy_module.query_transform(query, llm_util,  strategy_module.get_parameters()["query_transform_prompt"]) if hasattr(strategy_module, "query_transform") else query
+    return strategy_module.build_query(query_string)
+
+
+def build_rank_eval_request(golden_data, strategy_module, rows=None):
     """
     Build the request body for the _rank_eval API.
     This function prepares 'requests' for each query, 
     assigning rating=1 for each doc in the 'best_ids' list.
     
     The DSL 'request' is taken from `strategy_module.build_query(...)`.
+
+    `rows` limits the request to those positions of golden_data (all rows
+    by default); each keeps the "query_N" id it has in the full golden set.
     """
     index_name = strategy_module.get_parameters()['index_name']
     requests = []
     
-    for i, item in enumerate(golden_data):
+    for i in (range(len(golden_data)) if rows is None else rows):
+        item = golden_data[i]
         qid = f"query_{i+1}"
 
-        query_string = strategy_module.query_transform(item["query"], llm_util,  strategy_module.get_parameters()["query_transform_prompt"]) if hasattr(strategy_module, "query_transform") else item["query"]
-
-        query_dsl = strategy_module.build_query(query_string)
+        query_dsl = build_strategy_query(strategy_module, item["query"])
         
         ## Build ratings
         ratings = []
@@ -109,22 +213,381 @@ def build_rank_eval_request(golden_data, strategy_module):
     ## Rank eval body
     rank_eval_body = {
         "requests": requests,
-        "metric": {
-            "dcg": {
-                "k": 10,
-                "normalize": True
-            }
-            # "recall": {
-            #     "k": 10,
-            #     "relevant_rating_threshold": 1
-            # }
-        }
+        "metric": RANK_EVAL_METRIC
     }
     
     return rank_eval_body
 
 
 
+def enabled_strategies(strategy_modules):
+    """
+    Filter out strategies whose is_disabled() returns True.
+    """
+    enabled = {}
+    for strategy_name, module in strategy_modules.items():
+        if hasattr(module, "is_disabled") and module.is_disabled(): ## or strategy_name != "1a_bm25" :
+            print(f"Skipping strategy: {strategy_name}")
+            continue
+        enabled[strategy_name] = module
+    return enabled
+
+
+def chunk_rows(rows, chunk_size):
+    """
+    Split a list of golden set positions into chunk_size pieces.
+    """
+    for offset in range(0, len(rows), chunk_size):
+        yield rows[offset:offset + chunk_size]
+
+
+def rank_eval_chunk(es, strategy_name, module, golden_data, rows):
+    """
+    Run one _rank_eval request for a chunk of golden set rows.
+
+    Returns { row: metric_score } for every row in the chunk, with None
+    scores if the request failed.
+    """
+    rank_eval_body = build_rank_eval_request(golden_data, module, rows)
+    # print(json.dumps(rank_eval_body, indent=4))
+
+    index_name = module.get_parameters()['index_name']
+
+    try:
+        response = es.rank_eval(body=rank_eval_body, index=index_name)
+        ## response structure reference:
+        ## {
+        ##   "metric_score": 0.85,   # overall metric
+        ##   "details": {
+        ##       "query_1": { "metric_score": 1.0, "unrated_docs": [], ... },
+        ##       "query_2": { "metric_score": 0.5, ... },
+        ##       ...
+        ##   }
+        ## }
+        return {i: response["details"][f"query_{i+1}"]["metric_score"] for i in rows}
+
+    except Exception as e:
+        print(f"Error running rank_eval for strategy {strategy_name} (queries {rows[0]+1}-{rows[-1]+1}): {e}")
+        traceback.print_exc()  
+        print(json.dumps(rank_eval_body, indent=4))
+
+        # Optionally fill with None or 0
+        return {i: None for i in rows}
+
+
+def run_rank_eval(es, golden_data, strategy_modules, strategy_rows=None,
+                  max_workers=RANK_EVAL_WORKERS, chunk_size=RANK_EVAL_CHUNK_SIZE):
+    """
+    Run _rank_eval for the given strategies, fanning out across strategies
+    and across chunks of the golden set on a bounded thread pool.
+
+    strategy_rows optionally limits each strategy to some golden set
+    positions: { strategy_name: [row, ...] } (all rows by default).
+
+    Returns { (strategy_name, row): metric_score or None }.
+    """
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for strategy_name, module in strategy_modules.items():
+            rows = strategy_rows[strategy_name] if strategy_rows is not None else list(range(len(golden_data)))
+            if not rows:
+                continue
+
+            print(f"Starting strategy: {strategy_name} ({len(rows)} queries)")
+            for chunk in chunk_rows(rows, chunk_size):
+                futures.append((strategy_name, executor.submit(
+                    rank_eval_chunk, es, strategy_name, module, golden_data, chunk)))
+
+    scores = {}
+    for strategy_name, future in futures:
+        for i, score in future.result().items():
+            scores[(strategy_name, i)] = score
+    return scores
+
+
+def msearch_chunk(es, strategy_name, module, golden_data, rows, depth):
+    """
+    Send one chunk of golden set rows for a strategy through _msearch.
+    Returns the ranked id list for each row (None where the search failed).
+    """
+    index_name = module.get_parameters()['index_name']
+    try:
+        bodies = [build_strategy_query(module, golden_data[i]["query"]) for i in rows]
+        return msearch_ranked_ids(es, index_name, bodies, depth)
+    except Exception as e:
+        print(f"Error running msearch for strategy {strategy_name}: {e}")
+        traceback.print_exc()
+        return [None] * len(rows)
+
+
+def run_local_eval(es, golden_data, strategy_modules, strategy_rows=None, ks=LOCAL_METRIC_KS,
+                   max_workers=RANK_EVAL_WORKERS, chunk_size=RANK_EVAL_CHUNK_SIZE):
+    """
+    Local alternative to run_rank_eval: fetch each strategy's rankings once
+    through _msearch and score every metric at every cutoff client side.
+
+    Returns { (strategy_name, row): { "ndcg@1": score, ..., "mrr": score } },
+    with None for rows whose search failed.
+    """
+    depth = max(ks)
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for strategy_name, module in strategy_modules.items():
+            rows = strategy_rows[strategy_name] if strategy_rows is not None else list(range(len(golden_data)))
+            if not rows:
+                continue
+
+            print(f"Starting strategy: {strategy_name} ({len(rows)} queries)")
+            futures[strategy_name] = (rows, [
+                executor.submit(msearch_chunk, es, strategy_name, module, golden_data, chunk, depth)
+                for chunk in chunk_rows(rows, chunk_size)
+            ])
+
+    metrics = {}
+    for strategy_name, (rows, chunk_futures) in futures.items():
+        ranked_ids = [ids for future in chunk_futures for ids in future.result()]
+        best_ids = [golden_data[i]["best_ids"] for i in rows]
+        scores = score_rankings(relevance_matrix(ranked_ids, best_ids, depth), [len(ids) for ids in best_ids], ks)
+
+        for pos, i in enumerate(rows):
+            ## failed searches get None like a failed _rank_eval
+            metrics[(strategy_name, i)] = {
+                name: float(values[pos]) for name, values in scores.items()
+            } if ranked_ids[pos] is not None else None
+
+    return metrics
+
+
+def summarize_local_metrics(local_metrics, strategy_names, row_count):
+    """
+    Average every local metric per strategy, leaving out failed searches.
+    Returns { strategy_name: { "ndcg@1": avg, ..., "mrr": avg } }.
+    """
+    metric_summary = {}
+    for strategy_name in strategy_names:
+        per_query = [local_metrics.get((strategy_name, i)) for i in range(row_count)]
+        per_query = [m for m in per_query if m is not None]
+        if not per_query:
+            continue
+        metric_summary[strategy_name] = {
+            name: sum(m[name] for m in per_query) / len(per_query) for name in per_query[0]
+        }
+    return metric_summary
+
+
+def write_metric_summary(metric_summary, csv_path=METRICS_CSV):
+    """
+    Write one row per strategy with the average of every local metric.
+    """
+    metric_names = next(iter(metric_summary.values()), {}).keys()
+    with open(csv_path, mode="w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["strategy"] + list(metric_names))
+        for strategy_name in sorted(metric_summary):
+            averages = metric_summary[strategy_name]
+            writer.writerow([strategy_name] + [averages[m] for m in metric_names])
+
+
+def fail(case, stage, error):
+    print(f"Error in {stage} for {case['strategy_name']} {case['qid']}: {error!r}")
+    case["error"] = f"{stage}: {error}"
+    case["actual_output"] = None
+
+
+def build_deep_eval_pipeline(es) -> AsyncPipeline:
+    """
+    Build the transform -> retrieve -> generate -> judge pipeline.
+    Each case flowing through it is a dict that the stages fill in. A case
+    that fails in any stage (an LLM or Elasticsearch error, or deepeval
+    failing on its judge batch) gets an "error" and skips the remaining
+    stages, so it ends up without scores and is retried by the next run,
+    while every other case carries on.
+    """
+    def transform(case):
+        ## pre-process the query string
+        module = case["module"]
+        query = case["query"]
+        try:
+            case["query_string"] = module.query_transform(query, llm_util,  module.get_parameters()["query_transform_prompt"]) if hasattr(module, "query_transform") else query
+        except Exception as e:
+            fail(case, "transform", e)
+        return case
+
+    def retrieve(case):
+        if "error" in case:
+            return case
+        try:
+            case["retrieval_context"] = case["module"].retrieve_context(es, case["query_string"])
+        except Exception as e:
+            fail(case, "retrieve", e)
+        return case
+
+    ## the retrieval stage runs anyway, so every semantic hit can be audited for free
+    semantic_cache = SemanticAnswerCache(audit_rate=1.0) if SEMANTIC_CACHE else None
+
+    def generate(case):
+        if "error" in case:
+            return case
+        module = case["module"]
+        try:
+            if semantic_cache is None:
+                case["actual_output"] = module.rag(llm_util, case["query_string"], case["retrieval_context"])
+            else:
+                case["actual_output"] = semantic_cache.answer(
+                    case["strategy_name"], case["query_string"],
+                    retrieve=lambda _: case["retrieval_context"],
+                    generate=lambda query_string, retrieval_context: module.rag(llm_util, query_string, retrieval_context),
+                    version=answer_version(getattr(module, "RAG_PROMPT_TEMPLATE", RAG_PROMPT_TEMPLATE), RAG_MODEL)
+                )
+        except Exception as e:
+            fail(case, "generate", e)
+        return case
+
+    def judge(cases):
+        ## test case names are only unique within a strategy, so judge each strategy's cases together
+        by_strategy = {}
+        for case in cases:
+            if "error" in case:
+                continue
+            by_strategy.setdefault(case["strategy_name"], {})[case["qid"]] = case
+
+        for strategy_cases in by_strategy.values():
+            testCases = [
+                generateLLMTestCase(qid, case["query"], case["actual_output"], case["retrieval_context"], case["correct_answer"])
+                for qid, case in strategy_cases.items()
+            ]
+            try:
+                rag_evaluation = evaluateTestCases(testCases)
+            except Exception as e:
+                for case in strategy_cases.values():
+                    fail(case, "judge", e)
+                continue
+
+            for test_result in  rag_evaluation.test_results:
+                scores = {"success": test_result.success}
+                for metric in  test_result.metrics_data:
+                    # print(f"{metric.name} : score {metric.score} | {metric.reason}")
+                    scores[metric.name] = {"score": metric.score, "reason": metric.reason }
+                strategy_cases[test_result.name]["scores"] = scores
+
+        return cases
+
+    return AsyncPipeline([
+        Stage("transform", transform, DEEP_EVAL_CONCURRENCY["transform"]),
+        Stage("retrieve", retrieve, DEEP_EVAL_CONCURRENCY["retrieve"]),
+        Stage("generate", generate, DEEP_EVAL_CONCURRENCY["generate"]),
+        Stage("judge", judge, DEEP_EVAL_CONCURRENCY["judge"], batch_size=DEEP_EVAL_JUDGE_BATCH_SIZE),
+    ], queue_size=DEEP_EVAL_QUEUE_SIZE)
+
+
+def run_deep_eval(es, golden_data, strategy_modules, strategy_rows=None):
+    """
+    Run (strategy, golden query) pairs through the deep eval pipeline, so
+    LLM and ES round trips of different queries overlap.
+
+    strategy_rows optionally limits each strategy to some golden set
+    positions: { strategy_name: [row, ...] } (all rows by default).
+
+    Returns { (strategy_name, row): {"actual_output": ..., "scores": {...}} }.
+    """
+    if WARM_RETRIEVALS:
+        warm_retrieval_cache(es, golden_data, strategy_modules, strategy_rows)
+
+    cases = []
+    for strategy_name, module in strategy_modules.items():
+        rows = strategy_rows[strategy_name] if strategy_rows is not None else list(range(len(golden_data)))
+        if not rows:
+            continue
+
+        print(f"Starting strategy: {strategy_name} ({len(rows)} queries)")
+        for i in rows:
+            item = golden_data[i]
+            cases.append({
+                "strategy_name": strategy_name,
+                "module": module,
+                "row": i,
+                "qid": f"query_{i+1}",
+                "query": item["query"],
+                ## correct answer from the golden data
+                "correct_answer": item["natural_answer"],
+            })
+
+    stratResults = {}
+    for case in build_deep_eval_pipeline(es).run(cases):
+        stratResult = {"actual_output": case["actual_output"]}
+        if "scores" in case:
+            stratResult["scores"] = case["scores"]
+        if "error" in case:
+            stratResult["error"] = case["error"]
+        stratResults[(case["strategy_name"], case["row"])] = stratResult
+    return stratResults
+
+
+def build_deep_eval_scores(golden_data, strategy_names, stratResults):
+    """
+    Assemble the score sheet written to deepeval_results.json, in the same
+    order a strategy-by-strategy, query-by-query run would produce:
+    {
+      "query_1": {
+        "query": ..., "correct_answer": ...,
+        "strategies": { strategy_name: {"actual_output": ..., "scores": {...}}, ... }
+      },
+      ...
+    }
+    """
+    deepEvalScores = {}
+    for strategy_name in strategy_names:
+        for i, item in enumerate(golden_data):
+            qid = f"query_{i+1}"
+            stratResult = stratResults.get((strategy_name, i))
+            if stratResult is None:
+                continue
+
+            if qid not in deepEvalScores:
+                deepEvalScores[qid] = { 
+                    "query" : item["query"], 
+                    "correct_answer": item["natural_answer"],
+                    "strategies": { strategy_name: stratResult} }
+            else:
+                deepEvalScores[qid]["strategies"][strategy_name] = stratResult
+    return deepEvalScores
+
+
+def run_incremental(store, phase, golden_data, strategy_modules, parameters, helper_files, run_phase):
+    """
+    Run one evaluation phase only for the strategy/query pairs that have no
+    stored result for their current inputs, store what came back and return
+    the merged { (strategy_name, row): result } for every pair.
+
+    Failed results (None, or deep eval cases without scores) are not stored
+    so the next run retries them.
+    """
+    keys = {}
+    strategy_rows = {}
+    for strategy_name, module in strategy_modules.items():
+        index_name = module.get_parameters()['index_name']
+        strategy_parameters = {**module.get_parameters(), **parameters}
+        strategy_rows[strategy_name] = []
+        for i, item in enumerate(golden_data):
+            key = store.make_key(phase, [module.__file__] + helper_files, item, index_name, strategy_parameters)
+            keys[(strategy_name, i)] = key
+            if not INCREMENTAL_EVAL or key not in store:
+                strategy_rows[strategy_name].append(i)
+
+    pending = sum(len(rows) for rows in strategy_rows.values())
+    print(f"{phase}: {pending} of {len(keys)} strategy/query pairs need to run")
+
+    for pair, result in run_phase(strategy_rows).items():
+        if result is None or (phase == "deep_eval" and "scores" not in result):
+            continue
+        store.put(keys[pair], result)
+
+    merged = {pair: store.get(key) for pair, key in keys.items()}
+    store.save()
+    return merged
+
+
 def main():
     # 1. Connect to Elasticsearch
     es = get_es()
@@ -136,6 +599,31 @@ def main():
 
     # 3. Load strategies from the strategies folder
     strategy_modules = load_strategies(STRATEGIES_FOLDER)  # {name: module}
+    enabled_modules = enabled_strategies(strategy_modules)
+
+    # 4. Previous results, so unchanged strategy/query pairs are not re-run
+    store = EvalResultStore(EVAL_STORE_PATH)
+
+    if WARM_QUERY_TRANSFORMS:
+        warm_query_transforms(golden_data, enabled_modules)
+
+    ## Search rank Evaluation
+    print("\b### SEARCH RANK EVAL")
+    if EVALUATION_MODE == "local":
+        local_metrics = run_incremental(
+            store, "local_eval", golden_data, enabled_modules,
+            {"ks": LOCAL_METRIC_KS}, LOCAL_EVAL_HELPERS,
+            lambda strategy_rows: run_local_eval(es, golden_data, enabled_modules, strategy_rows))
+        write_metric_summary(summarize_local_metrics(local_metrics, enabled_modules, len(golden_data)))
+        rank_scores = {
+            pair: metrics[PRIMARY_LOCAL_METRIC] if metrics is not None else None
+            for pair, metrics in local_metrics.items()
+        }
+    else:
+        rank_scores = run_incremental(
+            store, "rank_eval", golden_data, enabled_modules,
+            {"metric": RANK_EVAL_METRIC}, RANK_EVAL_HELPERS,
+            lambda strategy_rows: run_rank_eval(es, golden_data, enabled_modules, strategy_rows))
 
     ## We will store results in a structure like:
     ## {
@@ -144,116 +632,20 @@ def main():
     ##   ...
     ## }
     results = {}
-
-    ## Search rank Evaluation
-    print("\b### SEARCH RANK EVAL")
-    for strategy_name, module in strategy_modules.items():
-
-        if hasattr(module, "is_disabled") and module.is_disabled(): ## or strategy_name != "1a_bm25" :
-            print(f"Skipping strategy: {strategy_name}")
-            continue
-
-        print(f"Starting strategy: {strategy_name}")
-        rank_eval_body = build_rank_eval_request(golden_data, module)
-        # print(json.dumps(rank_eval_body, indent=4))
-
-        index_name = module.get_parameters()['index_name']
-        
-        # 4. Call the _rank_eval API
-        try:
-            response = es.rank_eval(body=rank_eval_body, index=index_name)
-            # print(response)
-            ## response structure reference:
-            ## {
-            ##   "metric_score": 0.85,   # overall metric
-            ##   "details": {
-            ##       "query_1": { "metric_score": 1.0, "unrated_docs": [], ... },
-            ##       "query_2": { "metric_score": 0.5, ... },
-            ##       ...
-            ##   }
-            ## }
-
-            ## Update results
-            for i, item in enumerate(golden_data):
-                qid = f"query_{i+1}"
-                query_text = item["query"]
-                
-                ndcg_for_this_query = response["details"][qid]["metric_score"]
-                
-                if query_text not in results:
-                    results[query_text] = {}
-                results[query_text][strategy_name] = ndcg_for_this_query
-
-            # print(json.dumps(response, indent=4))
-        except Exception as e:
-            print(f"Error running rank_eval for strategy {strategy_name}: {e}")
-            traceback.print_exc()  
-            print(json.dumps(rank_eval_body, indent=4))
-
-            # Optionally fill with None or 0
-            for item in golden_data:
-                query_text = item["query"]
-                if query_text not in results:
-                    results[query_text] = {}
-                results[query_text][strategy_name] = None
-
+    for strategy_name in enabled_modules:
+        for i, item in enumerate(golden_data):
+            query_text = item["query"]
+            if query_text not in results:
+                results[query_text] = {}
+            results[query_text][strategy_name] = rank_scores[(strategy_name, i)]
 
     ## Deep Eval Evaluation
     print("### DEEP EVAL")
-    deepEvalScores = {}
-    for strategy_name, module in strategy_modules.items():
-        if hasattr(module, "is_disabled") and module.is_disabled(): ## or strategy_name != "1a_bm25" :
-            print(f"Skipping strategy: {strategy_name}")
-            continue
-
-        print(f"Starting strategy: {strategy_name}")
-        testCases = []
-        for i, item in enumerate(golden_data):
-                qid = f"query_{i+1}"
-                query = item["query"]
-
-
-                ## correct answer from the golden data
-                correct_answer = item["natural_answer"]
-
-                ## pre-process the query string
-                query_string = module.query_transform(query, llm_util,  module.get_parameters()["query_transform_prompt"]) if hasattr(module, "query_transform") else query
-
-                ## do the RAG
-                retrieval_context = module.retrieve_context(es, query_string)
-                actual_output = module.rag(llm_util, query_string, retrieval_context)
-
-
-                ## fill in query and strategy responses in score sheet
-                stratResult = {"actual_output": actual_output}
-                if qid not in deepEvalScores:
-                    deepEvalScores[qid] = { 
-                        "query" : query, 
-                        "correct_answer": correct_answer,
-                        "strategies": { strategy_name: stratResult} }
-                else:
-                    deepEvalScores[qid]["strategies"][strategy_name] = stratResult
-
-                ## prep deel eval test case for later batch evaluation
-                testCase = generateLLMTestCase(qid, query, actual_output, retrieval_context, correct_answer)
-                testCases.append(testCase)
-
-        ## Run evaluations for this strategy      
-        rag_evaluation = evaluateTestCases(testCases)
-
-        for test_result in  rag_evaluation.test_results:
-            quid = test_result.name
-
-            success = test_result.success
-            scores = {"success": success}
-            # print(f"name: {quid} | success: {success}")
-            for metric in  test_result.metrics_data:
-                # print(f"{metric.name} : score {metric.score} | {metric.reason}")
-                scores[metric.name] = {"score": metric.score, "reason": metric.reason }
-            
-            deepEvalScores[quid]["strategies"][strategy_name]["scores"] = scores
-            
-            
+    stratResults = run_incremental(
+        store, "deep_eval", golden_data, enabled_modules,
+        {}, DEEP_EVAL_HELPERS,
+        lambda strategy_rows: run_deep_eval(es, golden_data, enabled_modules, strategy_rows))
+    deepEvalScores = build_deep_eval_scores(golden_data, enabled_modules, stratResults)
 
     ## save the scores to disk
     # print(json.dumps(deepEvalScores, indent=2))
@@ -337,6 +729,10 @@ def main():
 
     print(f"Evaluation complete. Results written to {OUTPUT_CSV}")
 
+    print_cache_stats()
+    with open(CACHE_STATS_JSON, "w", encoding="utf-8") as f:
+        json.dump(cache_stats(), f, indent=2)
+
 
 
 if __name__ == "__main__":
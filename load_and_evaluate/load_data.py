@@ -1,12 +1,11 @@
-from pathlib import Path
-import pickle
 import os
-from tqdm import tqdm
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from utility.util_es import get_es, bulkLoadIndex
+from utility.util_es import get_es, parallelBulkLoad, fetch_content_hashes, delta_actions, CONTENT_HASH_FIELD, INFERENCE_HASH_FIELD
+from utility.util_dataset import partition_files, iter_records
+from utility.util_docstore import DocStore, DOCSTORE_PATH
 
 es = get_es()
 
@@ -17,6 +16,9 @@ def check_and_create_index(es, index_name, settings, mappings):
         es.indices.create(index=index_name, settings=settings, mappings=mappings)
     else:
         print(f"Index '{index_name}' already exists.")
+        # Indices created before delta loading need the hash fields added
+        es.indices.put_mapping(index=index_name, properties={CONTENT_HASH_FIELD: content_hash_mapping,
+                                                             INFERENCE_HASH_FIELD: content_hash_mapping})
 
 def check_and_create_synonyms(es, synonym_set_name, synonym_set): 
     resp = es.synonyms.put_synonym(
@@ -90,6 +92,10 @@ simple_settings= {
         }
     }
 
+## hashes of the whole record and of the inference inputs, compared on every load so
+## only changed documents are sent and only changed inference inputs are embedded again
+content_hash_mapping = {"type": "keyword"}
+
 simple_mappings= {
     "dynamic_templates": [{
         "metadata_as_keyword": {
@@ -104,6 +110,8 @@ simple_mappings= {
         "id": {"type": "keyword"},
         "url": {"type": "keyword"},
         "crosslinked_keywords": {"type": "keyword"},
+        "content_hash": content_hash_mapping,
+        "inference_hash": content_hash_mapping,
         "title": {
             "type": "text",
             "fields": {
@@ -152,6 +160,8 @@ semantic_e5_mappings= {
         "id": {"type": "keyword"},
         "url": {"type": "keyword"},
         "crosslinked_keywords": {"type": "keyword"},
+        "content_hash": content_hash_mapping,
+        "inference_hash": content_hash_mapping,
         "title": {
             "type": "text",
             "analyzer": "sw_index_analyzer",
@@ -194,6 +204,8 @@ semantic_elser_mappings= {
         "lore": {"type": "text", "copy_to": "lore_semantic"},
         "behind_the_scenes": {"type": "text"},
         "crosslinked_keywords": {"type": "keyword"},
+        "content_hash": content_hash_mapping,
+        "inference_hash": content_hash_mapping,
         "lore_semantic": {
           "type": "semantic_text",
           "inference_id": ".elser-2-elasticsearch"
@@ -210,11 +222,10 @@ check_and_create_index(es, "star_wars_sem_elser", simple_settings, semantic_else
 
 
 dataFolder = "./Dataset"
-pickeFileTemplate= "starwars_all_canon_data_*.pickle"
 
 
 
-## Schema of pickle file objects
+## Schema of dataset records (Parquet partitions, see utility/util_dataset.py)
 # {
 #     'id': key,
 #     'url': page_url,
@@ -227,27 +238,65 @@ pickeFileTemplate= "starwars_all_canon_data_*.pickle"
 # }
 
 
-## Upload to star_wars_simple
-count = 0
-files = sorted(Path(dataFolder).glob(pickeFileTemplate))
-print(f"Count of file: {len(files)}")
-for fn in files:
-    print(f"Starting file: {fn}")
-    with open(fn,'rb') as f:
-        part = pickle.load(f)
-        batch = []
-        # print( type(enumerate(part.items())) )
-        # bulkLoadIndex(es, part.items(), "star_wars_simple", "id", 10)
+BULK_CHUNK_SIZE = 500                    # max docs per bulk request
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024  # max bytes per bulk request, long lore pages add up quickly
+BULK_MAX_IN_FLIGHT = 4                   # concurrent bulk requests
+
+## Indices kept in sync with ./Dataset by sending only created / changed / deleted documents.
+## Once the semantic indices are populated (see README) add "star_wars_sem_e5" and
+## "star_wars_sem_elser" here, so a re-scrape only pays inference for the pages that changed.
+DELTA_TARGET_INDICES = ["star_wars_simple"]
+DELETE_MISSING = True                    # delete indexed documents that are no longer in ./Dataset
+## Fields copied into each index's semantic_text fields. A changed document whose
+## inference fields are unchanged is partially updated, keeping its embeddings.
+INFERENCE_FIELDS = {
+    "star_wars_sem_e5": ["lore"],
+    "star_wars_sem_elser": ["lore"],
+}
+
+## Where the records come from: "partitions" (Parquet files in ./Dataset) or
+## "docstore" (the SQLite store kept by scrape/docstore.py, read in id order)
+DATA_SOURCE = "partitions"
+
 
-        for ix, (key, record) in tqdm(enumerate(part.items()), total=len(part)):
-            batch.append( record )
+def iter_dataset(files):
+    """
+    Stream the records of every partition file, one row group at a time.
+    """
+    for fn in files:
+        print(f"Starting file: {fn}")
+        yield from iter_records([fn])
 
-            if len(batch) >= 500:
-                bulkLoadIndex(es, batch, "star_wars_simple", "id", 100)
-                batch = []
 
-        if len(batch) > 0:
-            bulkLoadIndex(es, batch, "star_wars_simple", "id", 100)
-            batch = []
+## Delta upload to each target index
+if DATA_SOURCE == "docstore":
+    store = DocStore(DOCSTORE_PATH)
+    print(f"Doc store {DOCSTORE_PATH} has {len(store)} records")
+    if len(store) == 0:
+        ## an empty dataset would otherwise delete every indexed document
+        raise SystemExit(f"No records in {DOCSTORE_PATH}")
+    read_dataset = store.iter_records
+else:
+    files = partition_files(dataFolder)
+    print(f"Count of file: {len(files)}")
+    if not files:
+        ## an empty dataset would otherwise delete every indexed document
+        raise SystemExit(f"No dataset partitions found in {dataFolder}")
+    read_dataset = lambda: iter_dataset(files)
 
+for index_name in DELTA_TARGET_INDICES:
+    existing_hashes = fetch_content_hashes(es, index_name)
+    print(f"Index '{index_name}' has {len(existing_hashes)} documents")
 
+    stats = {}
+    parallelBulkLoad(
+        es,
+        delta_actions(read_dataset(), index_name, "id", existing_hashes, stats, delete_missing=DELETE_MISSING,
+                      inference_fields=INFERENCE_FIELDS.get(index_name)),
+        chunk_size=BULK_CHUNK_SIZE,
+        max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+        max_in_flight=BULK_MAX_IN_FLIGHT
+    )
+    print(f"Index '{index_name}': {stats['created']} created, {stats['updated']} updated, "
+          f"{stats['deleted']} deleted, {stats['unchanged']} unchanged, "
+          f"{stats['reused_inference']} updated without new inference")
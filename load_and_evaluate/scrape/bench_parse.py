@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import pickle
+import re
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))  # run from load_and_evaluate/, like the other scripts
+
+from bs4 import BeautifulSoup
+
+import util_parse
+from util_fetch import AsyncFetcher
+
+## Compares pages/sec of the shared lxml parser (util_parse.py) with the
+## BeautifulSoup html.parser implementation the scrape scripts used before,
+## on saved page HTML. Also reports pages whose records differ.
+##
+##   python scrape/bench_parse.py --download 200      # save 200 pages to the fixture folder first
+##   python scrape/bench_parse.py --workers 8
+
+fixtures_folder = './Dataset/fixtures/'
+pages_file = './Dataset/starwars_all_canon_dict.pickle'
+
+
+def parse_page_bs4(key: str, page_url: str, content: bytes, pages) -> dict:
+    """
+    The previous parser, kept as the benchmark baseline (minus its per-paragraph print).
+    """
+    soup = BeautifulSoup(content, "html.parser")
+
+    heading = soup.find('h1', id='firstHeading')
+    if heading is None:
+        return None
+    heading = heading.text
+
+    is_character = False
+    side_bar = {}
+    side_bar_meta = {'is_character': is_character}
+    sec = soup.find_all('section', class_='pi-item')
+    for s in sec:
+        title = s.find('h2')
+        if title is None:
+            title = '<no category>'
+            m_title = ""
+        else:
+            title = title.text
+            m_title = re.sub(r'\W+', '_', title.lower()).strip('_')
+        side_bar[title] = {}
+        items = s.find_all('div', class_='pi-item')
+        for item in items:
+            attr = item.find('h3', class_='pi-data-label')
+            if attr is None:
+                attr = '<no attribute>'
+                m_attr = 'no_attribute'
+            else:
+                attr = attr.text
+                m_attr = re.sub(r'\W+', '_', attr.lower()).strip('_')
+            if attr == 'Species':
+                is_character = True
+                side_bar_meta['is_character'] = is_character
+            value = re.sub(r"[\(\[].*?[\)\]]", '', '], '.join(item.find('div', class_='pi-data-value').text.split(']')))
+            value = value.strip()[:-1].replace(',,', ',')
+            if ',' in value:
+                value = [i.strip() for i in value.split(',') if i.strip() != '']
+            side_bar[title][attr] = value
+            m_key = "_".join([m_title, m_attr])
+            side_bar_meta[m_key] = value
+
+    raw_content = soup.find('div', class_='mw-parser-output')
+    keywords = []
+    lore_pgs = []
+    behind_the_scenes_pgs = []
+    if raw_content is not None:
+        lore_pgs.append(f"# {heading.strip()}")
+        write_to_lore = True
+        for child in raw_content.find_all(recursive=False):
+            for aside in child.find_all("aside"):
+                aside.replaceWith('')
+            if child.name == 'h2':
+                headline = child.find('span', class_='mw-headline')
+                if headline:
+                    appending = f"## {headline.text.strip()}"
+                    if appending == "## Behind the scenes":
+                        write_to_lore = False
+                    if appending in ["## Appearances", "## Sources", "## Notes and references", "## External links"]:
+                        continue
+                    lore_pgs.append(appending) if write_to_lore else behind_the_scenes_pgs.append(appending)
+            elif child.name == 'p':
+                cleaned_paragraph = re.sub(r"[\(\[].*?[\)\]]", '', child.text.strip())
+                lore_pgs.append(cleaned_paragraph) if write_to_lore else behind_the_scenes_pgs.append(cleaned_paragraph)
+
+        for link in raw_content.find_all('a'):
+            part = link.get('href')
+            if part is not None:
+                part = part.split('/')[-1]
+                if part in pages and part != key:
+                    keywords.append(part)
+        keywords = list(set(keywords))
+
+    return {
+        'id': key,
+        'url': page_url,
+        'title': heading.strip(),
+        'side_bar_json': json.dumps(side_bar),
+        'metadata': side_bar_meta,
+        'lore': "\n\n".join(lore_pgs),
+        'behind_the_scenes': "\n\n".join(behind_the_scenes_pgs),
+        'crosslinked_keywords': keywords,
+    }
+
+
+def download_fixtures(pages: dict, count: int, folder: Path):
+    """
+    Save the HTML of the first `count` pages as <key>.html fixtures.
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    items = list(itertools.islice(pages.items(), count))
+
+    async def handle(key, url, result):
+        if result.error is None:
+            (folder / f"{key}.html").write_bytes(result.content)
+        else:
+            print(f"Could not download {url}: {result.error}")
+
+    asyncio.run(AsyncFetcher(concurrency=8).run(items, handle))
+
+
+def load_fixtures(folder: Path) -> list:
+    return [(path.stem, f"https://starwars.fandom.com/wiki/{path.stem}", path.read_bytes())
+            for path in sorted(folder.glob("*.html"))]
+
+
+def normalize(record: dict):
+    ## crosslinks come out of a set, compare them in a fixed order
+    if record is None:
+        return None
+    return {**record, 'crosslinked_keywords': sorted(record['crosslinked_keywords'])}
+
+
+def timed(label: str, fixtures: list, parse) -> list:
+    start = time.perf_counter()
+    records = parse()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(fixtures) / elapsed:10.1f} pages/s  ({elapsed:.2f}s)")
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the page parser against the previous BeautifulSoup parser")
+    parser.add_argument("--fixtures", default=fixtures_folder, help="folder of saved <key>.html pages")
+    parser.add_argument("--download", type=int, default=0, help="first download this many pages into the fixture folder")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes for the parallel run")
+    args = parser.parse_args()
+
+    pages = {}
+    if os.path.isfile(pages_file):
+        with open(pages_file, 'rb') as f:
+            pages = pickle.load(f)
+
+    folder = Path(args.fixtures)
+    if args.download:
+        download_fixtures(pages, args.download, folder)
+
+    fixtures = load_fixtures(folder)
+    if not fixtures:
+        raise SystemExit(f"No fixture pages in {folder}, use --download N or save some <key>.html files there")
+    ## fall back to the fixture keys so cross-links between fixtures still count
+    keys = set(pages) or {key for key, _, _ in fixtures}
+    util_parse.init_worker(keys)
+
+    print(f"{len(fixtures)} fixture pages")
+    baseline = timed("bs4 html.parser", fixtures,
+                     lambda: [parse_page_bs4(key, url, content, keys) for key, url, content in fixtures])
+    single = timed("lxml, 1 process", fixtures,
+                   lambda: [util_parse.parse_page(key, url, content, drop_empty=False) for key, url, content in fixtures])
+    timed(f"lxml, {args.workers} processes", fixtures,
+          lambda: list(util_parse.parse_pages(fixtures, keys, args.workers, drop_empty=False)))
+
+    mismatched = [key for (key, _, _), old, new in zip(fixtures, baseline, single) if normalize(old) != normalize(new)]
+    print(f"Records that differ from bs4: {len(mismatched)}")
+    for key in mismatched[:10]:
+        print(f"  {key}")
+
+
+if __name__ == "__main__":
+    main()
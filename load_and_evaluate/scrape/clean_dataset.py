@@ -0,0 +1,38 @@
+import argparse
+import os
+from functools import partial
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))  # run from load_and_evaluate/, like the other scripts
+
+from utility.util_dataset import read_records_by_id
+from utility.util_transform import run_transform
+from transforms import drop_empty_fields, replace_short_lore
+
+## Every dataset cleanup in one pass: each partition is streamed once
+## through all the stages below, partitions in parallel. A new cleanup is a
+## new stage in scrape/transforms.py added to build_stages(), not a new script.
+
+dataFolder = "./Dataset"
+repairedFn = dataFolder + '/repair_starwars_all_canon_data.parquet'
+
+
+def build_stages() -> list:
+    stages = []
+    if os.path.isfile(repairedFn):
+        stages.append(partial(replace_short_lore, repaired=read_records_by_id([repairedFn])))
+    stages.append(drop_empty_fields)
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the dataset cleanup stages over every partition")
+    parser.add_argument("--out", default=None, help="write cleaned partitions here instead of in place")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    run_transform(build_stages(), dataFolder, args.out, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+from pathlib import Path
+from tqdm import tqdm
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))  # run from load_and_evaluate/, like the other scripts
+
+from utility.util_dataset import LEGACY_PARTITION_GLOB, iter_records, write_partition
+
+## One-off conversion of the old pickle partitions to the Parquet dataset format
+dataFolder = "./Dataset"
+
+files = sorted(Path(dataFolder).glob(LEGACY_PARTITION_GLOB))
+print(f"Count of file: {len(files)}")
+
+for fn in tqdm(files):
+    writeFn = fn.with_suffix('.parquet')
+    count = write_partition(iter_records([fn]), writeFn)
+    print(f"Converted {fn} -> {writeFn} ({count} records)")
+
+repairFn = Path(dataFolder) / 'repair_starwars_all_canon_data.pickle'
+if repairFn.exists():
+    write_partition(iter_records([repairFn]), repairFn.with_suffix('.parquet'))
@@ -0,0 +1,46 @@
+import argparse
+import json
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))  # run from load_and_evaluate/, like the other scripts
+
+from utility.util_dataset import partition_files, iter_records, replace_partitions
+from utility.util_docstore import DocStore, DOCSTORE_PATH
+
+## Keeps the scraped corpus in an SQLite doc store keyed by page id:
+##
+##   python scrape/docstore.py import            # partitions in ./Dataset -> doc store
+##   python scrape/docstore.py get Luke_Skywalker
+##   python scrape/docstore.py export            # doc store -> partitions, in key order
+##
+## load_data.py can read the doc store directly (DATA_SOURCE = "docstore").
+
+dataFolder = "./Dataset"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import, export and look up records in the doc store")
+    parser.add_argument("command", choices=["import", "export", "get"])
+    parser.add_argument("ids", nargs="*", help="page ids for get")
+    parser.add_argument("--path", default=DOCSTORE_PATH)
+    args = parser.parse_args()
+
+    with DocStore(args.path) as store:
+        if args.command == "import":
+            files = partition_files(dataFolder)
+            count = store.upsert_many(iter_records(files))
+            print(f"Upserted {count} records from {len(files)} partitions, {len(store)} in {args.path}")
+        elif args.command == "export":
+            count = replace_partitions(dataFolder, store.iter_records())
+            print(f"Exported {count} records to {dataFolder}")
+        else:
+            found = store.get_many(args.ids)
+            for record in found.values():
+                print(json.dumps(record, indent=2, ensure_ascii=False))
+            missing = set(args.ids) - set(found)
+            if missing:
+                print(f"Not found: {', '.join(sorted(missing))}")
+
+
+if __name__ == "__main__":
+    main()
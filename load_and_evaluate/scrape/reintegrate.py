@@ -1,55 +1,36 @@
-from pathlib import Path
-import pickle
 import os
-from tqdm import tqdm
-
-from typing import Optional
-import re
-import requests
-from bs4 import BeautifulSoup
-import json
+from functools import partial
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))  # run from load_and_evaluate/, like the other scripts
 
+from utility.util_dataset import read_records_by_id
+from utility.util_transform import run_transform
+from utility.util_docstore import DocStore, DOCSTORE_PATH
+from transforms import has_short_lore, replace_short_lore
 
 ## Go through already parsed files
 dataFolder = "./Dataset"
-pickeFileTemplate= "starwars_all_canon_data_*.pickle"
 
 newDataFolder = "./RepairDataset"
 
+## the records re-scraped by repair.py
+repairedFn = dataFolder + f'/repair_starwars_all_canon_data.parquet'
+
+
+def main():
+    repairedDict = read_records_by_id([repairedFn])
+    ## short-lore records are swapped for their repaired version, or dropped when there is none
+    run_transform([partial(replace_short_lore, repaired=repairedDict)], dataFolder, newDataFolder)
+
+    ## a doc store (scrape/docstore.py import) gets the same swap, by id
+    if os.path.isfile(DOCSTORE_PATH):
+        with DocStore(DOCSTORE_PATH) as store:
+            short = [record['id'] for record in store.iter_records() if has_short_lore(record)]
+            upserted = store.upsert_many(repairedDict[doc_id] for doc_id in short if doc_id in repairedDict)
+            dropped = store.delete_many([doc_id for doc_id in short if doc_id not in repairedDict])
+        print(f"Replaced {upserted} short-lore records and dropped {dropped} without a repair in {DOCSTORE_PATH}")
+
 
-files = sorted(Path(dataFolder).glob(pickeFileTemplate))
-print(f"Count of file: {len(files)}")
-
-
-failCounter = 0
-## Open the repaired file
-repairedFn = dataFolder + f'/repair_starwars_all_canon_data.pickle'
-with open(repairedFn,'rb') as repairedF:
-    repairedDict = pickle.load(repairedF)
-    
-    ## merge data strcuture
-    integrated_records = {}
-    
-    for fn in files:
-        print(f"Starting read on file: {fn}")
-        with open(fn,'rb') as f:
-            part = pickle.load(f)
-            for ix, (key, record) in tqdm(enumerate(part.items()), total=len(part)):
-                lore = record['lore']
-                is_short_lore = lore.count('\n') == 0
-                if(is_short_lore):
-                    if(key in repairedDict):
-                        integrated_records[key] = repairedDict[key]
-                    else:
-                        failCounter = failCounter + 1
-                        print(f"Failed to find repaired record for {key}")
-                else:
-                    integrated_records[key] = record
-        writeFn = str(fn).replace('Dataset', 'RepairDataset')
-        print(f"Persisting new file: {writeFn}")
-        with open(writeFn, 'wb') as wf:
-            pickle.dump(integrated_records, wf, protocol=pickle.HIGHEST_PROTOCOL)
-        
-        ## clear merged data strcuture for next file
-        integrated_records = {}
-print(f"records with issues: {failCounter}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import os
+import pickle
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))  # run from load_and_evaluate/, like the other scripts
+
+from tqdm import tqdm
+
+from utility.util_dataset import PARTITION_TEMPLATE, PARTITION_GLOB, write_partition
+from util_archive import HtmlArchive, ARCHIVE_FOLDER, iter_members
+from util_parse import init_worker, parse_page
+
+## Rebuilds the Parquet dataset from the raw HTML archive written by
+## scrape_wookieepedia_pages.py, without touching the network. Every archive
+## shard is parsed on its own core into one partition file, e.g. after a
+## parser fix:
+##
+##   python scrape/reparse_archive.py
+
+folder = './Dataset/'
+pages_file = './Dataset/starwars_all_canon_dict.pickle'
+
+
+def reparse_shard(shard_path: str, entries: list, out_path: str) -> tuple:
+    """
+    Parse the archived pages of one shard and write them to out_path.
+    Runs in a worker process. Returns (records written, keys that failed).
+    """
+    failed = []
+
+    def records():
+        for key, url, content in iter_members(shard_path, entries):
+            try:
+                record = parse_page(key, url, content)
+            except Exception as e:
+                print(f'Failed! {key}: {e}')
+                failed.append(key)
+                continue
+            if record is not None:
+                yield record
+
+    count = write_partition(records(), out_path)
+    return count, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the dataset partitions from the raw HTML archive")
+    parser.add_argument("--archive", default=ARCHIVE_FOLDER)
+    parser.add_argument("--out", default=folder, help="dataset folder whose partitions are replaced")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    archive = HtmlArchive(args.archive)
+    with open(pages_file, 'rb') as f:
+        pages = pickle.load(f)
+
+    ## pages dropped from the page list since they were archived stay out of the dataset
+    kept = {shard: [entry for entry in archive.shard_entries(shard) if entry["key"] in pages]
+            for shard in sorted({entry["shard"] for entry in archive.entries.values()})}
+    shards = [shard for shard, entries in kept.items() if entries]
+    if not shards:
+        raise SystemExit(f"No pages of {pages_file} archived in {args.archive}")
+    print(f"Reparsing {sum(len(entries) for entries in kept.values())} of {len(archive)} archived pages "
+          f"from {len(shards)} shards")
+
+    ## write next to the dataset and swap in at the end, so a failed run leaves the old partitions alone
+    out = Path(args.out)
+    staging = out / '.reparse'
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    total = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(set(pages.keys()),)) as pool:
+        futures = [
+            pool.submit(reparse_shard, str(archive.shard_path(shard)), kept[shard],
+                        str(staging / PARTITION_TEMPLATE.format(number)))
+            for number, shard in enumerate(shards, start=1)
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            count, shard_failed = future.result()
+            total += count
+            failed.extend(shard_failed)
+
+    for path in out.glob(PARTITION_GLOB):
+        path.unlink()
+    for path in sorted(staging.iterdir()):
+        os.replace(path, out / path.name)
+    staging.rmdir()
+
+    print(f"Wrote {total} records to {len(shards)} partitions in {out}, {len(failed)} pages failed to parse")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,186 +1,157 @@
-from typing import Optional
-
-import re
-from tqdm import tqdm
-import requests
-from bs4 import BeautifulSoup
-import pickle
+import argparse
+import itertools
 import json
+import os
+import pickle
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))  # run from load_and_evaluate/, like the other scripts
+
+from utility.util_dataset import merge_records, replace_partitions
+from util_fetch import AsyncFetcher
+from util_crawl import crawl, rebase_url
+from util_archive import HtmlArchive, ARCHIVE_FOLDER
+from util_crawl_state import CrawlState, STATE_FILE_PATH, utc_now
+from util_changes import API_URL, fetch_recent_changes, load_changes_file
+from util_journal import Journal, JOURNAL_FILE_PATH
 
 test_url = "https://starwars.fandom.com/wiki/Vespaara"
 
-scraped = {}
-failed = {}
-partition_size = 5000
 folder = './Dataset/'
-last_number= 0
+pages_file = './Dataset/starwars_all_canon_dict.pickle'
+failed_file = './Dataset/failed_pages.json'
 is_saving_enabled = True
 
-# !rm -rf ./data
-# !mkdir -p ./data
-
+## Crawl settings, overridable on the command line
+CONCURRENCY = 16      # requests in flight
+RATE_PER_HOST = 5.0   # requests per second per host
+BURST = 10            # requests a host may get at once after being idle
+MAX_RETRIES = 5       # retries for timeouts, connection errors, 429 and 5xx
 
 
-def scrape_page_to_soup(page_url: str) ->  Optional[BeautifulSoup]:
+def crawl_incremental(crawl_pages: dict, pages: dict, state: CrawlState, fetcher: AsyncFetcher, archive, args, saving: bool) -> dict:
     """
-    Fetches the HTML content of a webpage and parses it into a BeautifulSoup object.
-
-    Args:
-        url (str): The URL of the webpage to scrape.
-
-    Returns:
-        Optional[BeautifulSoup]: A BeautifulSoup object if the request is successful, None otherwise.
+    Refetch only pages that changed since the last crawl (per the recent
+    changes feed, or a conditional GET of every page), pages never crawled
+    and pages the last crawl failed on, and merge their new records into
+    the existing partitions. Pages deleted on the wiki are dropped.
     """
-    try:
-        result = requests.get(page_url)
-        result.raise_for_status()  # Raises an HTTPError for bad responses
-        content = result.content
-        return BeautifulSoup(content, "html.parser")
-    except requests.RequestException as e:
-        print(f"An error occurred while fetching the page: {e}")
-        return None
-
-
-
-
-with open('./Dataset/starwars_all_canon_dict.pickle', 'rb') as f:
-    pages = pickle.load(f)
-
-
-# is_saving_enabled = False
-# test_pages = {
-#     "Vespaara": test_url
-# }
-# for ix, (key, page_url) in tqdm(enumerate(test_pages.items()), total=(len(test_pages))):
+    if args.changes_file:
+        changed, deleted = load_changes_file(args.changes_file)
+    elif not args.no_feed and state.last_crawl:
+        changed, deleted = fetch_recent_changes(state.last_crawl, rebase_url(API_URL, args.base_url))
+    else:
+        changed, deleted = None, set()
+
+    for key in deleted:
+        state.forget(key)
+        ## so reparse_archive.py doesn't bring it back
+        if archive is not None:
+            archive.discard(key)
+    crawl_pages = {key: url for key, url in crawl_pages.items() if key not in deleted}
+    if changed is not None:
+        print(f"{len(changed)} pages changed and {len(deleted)} deleted since {state.last_crawl or 'the last crawl'}, "
+              f"{len(state.failed)} failed pages to retry")
+        crawl_pages = {key: url for key, url in crawl_pages.items()
+                       if key in changed or key not in state or key in state.failed}
+
+    updates = {}
+    def keep(record):
+        updates[record['id']] = record
+
+    failed = crawl(crawl_pages, keep, fetcher, page_keys=pages.keys(), base_url=args.base_url,
+                   parse_workers=args.parse_workers, archive=archive, state=state, conditional=True)
+    ## earlier failures outside this run (e.g. past --limit) stay on the retry list
+    failed.update({key: url for key, url in state.failed.items() if key not in crawl_pages})
+
+    if saving and (updates or deleted):
+        replaced, added, dropped = merge_records(folder, updates, deleted)
+        print(f"Updated {replaced} records, added {added} and removed {dropped} in {folder}")
+    return failed
+
+
+def crawl_full(crawl_pages: dict, pages: dict, state: CrawlState, fetcher: AsyncFetcher, archive, args, saving: bool) -> dict:
+    """
+    Crawl every page into the journal, then compact the journal into a new
+    set of partitions. With --resume, pages the journal already has are skipped.
+    """
+    journal = Journal(JOURNAL_FILE_PATH)
+    if args.resume:
+        completed, previously_failed = journal.status()
+        crawl_pages = {key: url for key, url in crawl_pages.items() if key not in completed}
+        print(f"Resuming: {len(completed)} pages already done, {len(previously_failed)} failed pages to retry, "
+              f"{len(crawl_pages)} pages to crawl")
+    else:
+        journal.reset()
 
+    try:
+        ## records only go to the journal while crawling, so an interruption loses at most one flush
+        crawl(crawl_pages, lambda record: None, fetcher, page_keys=pages.keys(), base_url=args.base_url,
+              parse_workers=args.parse_workers, archive=archive, state=state, journal=journal)
+    finally:
+        journal.close()
+
+    if saving:
+        count = replace_partitions(folder, journal.records())
+        print(f"Wrote {count} records to {folder}")
+    ## failures of earlier attempts that weren't retried successfully count too
+    return journal.status()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape the canon Wookieepedia pages into Parquet partitions")
+    parser.add_argument("--base-url", help="fetch from this server instead of starwars.fandom.com, e.g. http://localhost:8000 serving fixture pages")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=RATE_PER_HOST, help="requests per second per host")
+    parser.add_argument("--parse-workers", type=int, default=None, help="parser processes (default: all cores)")
+    parser.add_argument("--limit", type=int, default=None, help="only scrape the first N pages")
+    parser.add_argument("--no-save", action="store_true", help="parse without writing partitions")
+    parser.add_argument("--no-archive", action="store_true", help=f"don't keep the raw HTML in {ARCHIVE_FOLDER}")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted crawl from its journal: skip finished pages, retry failed ones")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only refetch pages that changed since the last crawl and merge them into the partitions")
+    parser.add_argument("--changes-file", help="with --incremental, take changed titles from this file instead of the wiki's recent changes")
+    parser.add_argument("--no-feed", action="store_true", help="with --incremental, send a conditional GET for every page instead of reading the recent changes")
+    args = parser.parse_args()
+
+    with open(pages_file, 'rb') as f:
+        pages = pickle.load(f)
+
+    crawl_pages = dict(itertools.islice(pages.items(), args.limit)) if args.limit else pages
+    # crawl_pages = { "Vespaara": test_url }
+
+    fetcher = AsyncFetcher(concurrency=args.concurrency, rate_per_host=args.rate, burst=BURST, max_retries=MAX_RETRIES)
+    saving = is_saving_enabled and not args.no_save
+    ## raw HTML goes to the archive so scrape/reparse_archive.py can rebuild the dataset offline
+    archive = None if args.no_archive else HtmlArchive(ARCHIVE_FOLDER)
+    ## validators and body hashes of every page, used by the next --incremental run
+    state = CrawlState(STATE_FILE_PATH)
+    crawl_start = utc_now()
 
-for ix, (key, page_url) in tqdm(enumerate(pages.items()), total=(len(pages))):
     try:
-        
-        # Get page
-        soup = scrape_page_to_soup(page_url)
-
-        # Get title
-        heading = soup.find('h1', id='firstHeading')
-        if heading is None: 
-            print(f"page had no h1 firstHeading {page_url}")
-            continue
-        heading = heading.text
-
-        # Extract Sidebar
-        is_character = False
-        side_bar = {}
-        side_bar_meta = {'is_character': is_character}
-        sec = soup.find_all('section', class_='pi-item')
-        for s in sec:
-            title = s.find('h2')
-            if title is None:
-                title = '<no category>'
-                m_title = ""
-            else:
-                title = title.text
-                m_title = re.sub(r'\W+', '_', title.lower()).strip('_')
-            side_bar[title] = {}
-            items = s.find_all('div', class_='pi-item')
-            for item in items:
-                attr = item.find('h3', class_='pi-data-label')
-                if attr is None:
-                    attr = '<no attribute>'
-                    m_attr = 'no_attribute'
-                else:
-                    attr = attr.text
-                    m_attr = re.sub(r'\W+', '_', attr.lower()).strip('_')
-                if attr == 'Species': 
-                    is_character = True
-                    side_bar_meta['is_character'] = is_character
-                # value = re.sub("[\(\[].*?[\)\]]" ,'', '], '.join(item.find('div', class_='pi-data-value').text.split(']')))
-                value = re.sub(r"[\(\[].*?[\)\]]", '', '], '.join(item.find('div', class_='pi-data-value').text.split(']')))
-                value = value.strip()[:-1].replace(',,', ',')
-                if ',' in value:
-                    value = [i.strip() for i in value.split(',') if i.strip() != '']
-                side_bar[title][attr] = value
-                m_key = "_".join([m_title, m_attr])
-                side_bar_meta[m_key] = value
-
-
-        ## Raw page content
-
-        raw_content = soup.find('div', class_='mw-parser-output')
-        keywords = []
-        lore_pgs = []
-        behind_the_scenes_pgs = []
-        if raw_content is not None:
-            lore_pgs.append(f"# {heading.strip()}")
-            write_to_lore = True
-            for child in raw_content.find_all(recursive=False):
-
-                ##remove asides
-                for aside in child.find_all("aside"):
-                    aside.replaceWith('')
-
-                # Handle <h2> tags
-                if child.name == 'h2':
-                    headline = child.find('span', class_='mw-headline')
-                    if headline:
-                        appending = f"## {headline.text.strip()}"
-                        if appending == "## Behind the scenes":
-                            write_to_lore = False
-                        if appending in ["## Appearances", "## Sources", "## Notes and references", "## External links"]:
-                            continue
-                        lore_pgs.append(appending) if write_to_lore  else behind_the_scenes_pgs.append(appending)
-                
-                # Handle <p> tags
-                elif child.name == 'p':
-                    cleaned_paragraph = re.sub(r"[\(\[].*?[\)\]]", '', child.text.strip())
-                    print(cleaned_paragraph)
-                    lore_pgs.append(cleaned_paragraph) if write_to_lore else behind_the_scenes_pgs.append(cleaned_paragraph)
-
-            # Cross-links
-            for link in raw_content.find_all('a'):
-                part = link.get('href')
-                if part is not None:
-                    part = part.split('/')[-1] 
-                    if part in pages.keys() and part != key:
-                        keywords.append(part)
-            keywords = list(set(keywords))
-
-
-        # Data object
-        scraped[key] = {
-            'id': key,
-            'url': page_url,
-            'title': heading.strip(),
-            'side_bar_json': json.dumps(side_bar),
-            'metadata': side_bar_meta,
-            'lore': "\n\n".join(lore_pgs),
-            'behind_the_scenes': "\n\n".join(behind_the_scenes_pgs),
-            'crosslinked_keywords': keywords,
-        }
-
-        if 'lore' in scraped[key] and scraped[key]['lore'] == "":
-            del scraped[key]['lore']
-            
-        if 'behind_the_scenes' in scraped[key] and scraped[key]['behind_the_scenes'] == "":
-            del scraped[key]['behind_the_scenes']
-
-        # print(json.dumps(scraped[key],indent=4))
-
-        
-        # save partition
-        if is_saving_enabled:
-            if (ix + 1) % partition_size == 0:
-                last_number = (ix+1) // partition_size
-                fn = folder + f'starwars_all_canon_data_{last_number}.pickle'
-                with open(fn, 'wb') as f:
-                    pickle.dump(scraped, f, protocol=pickle.HIGHEST_PROTOCOL)
-                scraped = {}
-    except Exception as e:
-        print(f'Failed! {e}')
-        failed[key] = page_url
-    
-    
-# Save final part to disk
-if is_saving_enabled:
-    fn = folder + f'starwars_all_canon_data_{last_number + 1}.pickle'
-    with open(fn, 'wb') as f:
-        pickle.dump(scraped, f, protocol=pickle.HIGHEST_PROTOCOL)  
\ No newline at end of file
+        if args.incremental:
+            failed = crawl_incremental(crawl_pages, pages, state, fetcher, archive, args, saving)
+        else:
+            failed = crawl_full(crawl_pages, pages, state, fetcher, archive, args, saving)
+    finally:
+        if archive is not None:
+            archive.close()
+        state.save()
+
+    ## failed pages are kept in the state and retried by the next --incremental run,
+    ## so the change window can move on without them
+    state.save(last_crawl=crawl_start, failed=failed)
+
+    print(f"Crawl finished, {len(failed)} pages failed")
+    if failed:
+        with open(failed_file, 'w') as f:
+            json.dump(failed, f, indent=2)
+        print(f"Failed pages written to {failed_file}")
+    elif os.path.isfile(failed_file):
+        ## an earlier run's list would read as this run's failures
+        os.remove(failed_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,79 @@
 import requests
 from bs4 import BeautifulSoup 
 import pickle
+import json
+import os
 
 page_url = 'https://starwars.fandom.com/wiki/Category:Canon_articles'  # all canon articles
 base_url = 'https://starwars.fandom.com'
 
+## ETag / Last-Modified, links and next page of every listing page seen so far.
+## Listing pages that haven't changed come back 304 and are taken from here.
+state_file = './Dataset/category_state.json'
+listing_state = {}
+if os.path.isfile(state_file):
+    with open(state_file, 'r') as f:
+        listing_state = json.load(f)
+
+## one keep-alive connection for every listing page
+session = requests.Session()
+
 pages = {}
 page_num = 1
+unchanged = 0
 while page_url is not None:
-    result = requests.get(page_url)
-    content = result.content
-    soup = BeautifulSoup(content, "html.parser")
-    
-    # extract urls
-    links = soup.find_all('a', class_='category-page__member-link')
-    links_before = len(pages)
-    if links:
-        for link in links:
+    cached = listing_state.get(page_url)
+    headers = {}
+    if cached is not None:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    result = session.get(page_url, headers=headers)
+
+    if result.status_code == 304:
+        page_links = cached['links']
+        new_url = cached['next']
+        unchanged += 1
+    else:
+        result.raise_for_status()
+        soup = BeautifulSoup(result.content, "html.parser")
+
+        # extract urls
+        page_links = {}
+        for link in soup.find_all('a', class_='category-page__member-link'):
             url = base_url + link.get('href')
             key = link.get('href').split('/')[-1]
             if 'Category:' not in key:
-                pages[key] = url
+                page_links[key] = url
+
+        # get next page button
+        next_urls = soup.find_all("a", class_='category-page__pagination-next')
+        new_url = next_urls[0].get('href') if next_urls else None
+
+        listing_state[page_url] = {
+            'etag': result.headers.get('ETag'),
+            'last_modified': result.headers.get('Last-Modified'),
+            'links': page_links,
+            'next': new_url,
+        }
+
+    links_before = len(pages)
+    pages.update(page_links)
     new_links = len(pages) - links_before
-    print(f'Page {page_num} - {new_links} new links ({page_url})')
+    print(f'Page {page_num} - {new_links} new links ({page_url}){" (not modified)" if result.status_code == 304 else ""}')
     page_num += 1
-                
-    # get next page button
-    next_urls = soup.find_all("a", class_='category-page__pagination-next')
-    if next_urls:
-        new_url = next_urls[0].get('href')
-        if new_url == page_url:
-            break
-        else:
-            page_url = new_url
-    else:
-        page_url = None
+
+    if new_url == page_url:
+        break
+    page_url = new_url
+
 
 
+print(f'Number of pages: {len(pages)} ({unchanged} listing pages not modified)')
 
-print(f'Number of pages: {len(pages)}')
+with open(state_file, 'w') as f:
+    json.dump(listing_state, f)
 
 # Save to disk
 with open('./Dataset/starwars_all_canon_dict.pickle', 'wb') as f:
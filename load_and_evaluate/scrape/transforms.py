@@ -0,0 +1,33 @@
+## Record stages for utility/util_transform.py, shared by the dataset cleanup scripts.
+## Each takes a record and returns it (changed in place) or None to drop it.
+
+
+def drop_empty_fields(record: dict) -> dict:
+    """
+    Remove empty lore / behind_the_scenes fields, like the scraper does.
+    """
+    if 'lore' in record and record['lore'] == "":
+        del record['lore']
+    if 'behind_the_scenes' in record and record['behind_the_scenes'] == "":
+        del record['behind_the_scenes']
+    return record
+
+
+def has_short_lore(record: dict) -> bool:
+    """
+    Lore of a single paragraph (or none) means the page didn't parse properly.
+    """
+    return record.get('lore', "").count('\n') == 0
+
+
+def replace_short_lore(record: dict, repaired: dict) -> dict:
+    """
+    Swap a short-lore record for its re-scraped version from repaired
+    ({ id: record }), dropping it when there is none.
+    """
+    if not has_short_lore(record):
+        return record
+    replacement = repaired.get(record['id'])
+    if replacement is None:
+        print(f"Failed to find repaired record for {record['id']}")
+    return replacement
@@ -0,0 +1,175 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+
+ARCHIVE_FOLDER = './Dataset/archive/'
+SHARD_COUNT = 64
+INDEX_FILE = 'index.jsonl'
+SHARD_TEMPLATE = 'shard_{:03d}.warc.gz'
+
+
+def shard_of(key: str, shard_count: int = SHARD_COUNT) -> int:
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest(), 16) % shard_count
+
+
+def read_member(f, entry: dict) -> bytes:
+    """
+    Read the body of one archived page from an open shard file.
+    """
+    f.seek(entry["offset"])
+    data = gzip.decompress(f.read(entry["length"]))
+    return data[data.index(b"\n") + 1:]
+
+
+def iter_members(shard_path, entries: list):
+    """
+    Yield (key, url, content) for index entries of one shard, without
+    loading the archive index (e.g. in a worker process).
+    """
+    if not entries:
+        return
+    with open(shard_path, "rb") as f:
+        for entry in entries:
+            yield entry["key"], entry["url"], read_member(f, entry)
+
+
+class HtmlArchive:
+    """
+    Append-only archive of fetched page HTML, so pages can be re-parsed
+    without downloading them again.
+
+    Pages are spread over shard files by a hash of their key. Every page is
+    one gzip member (a JSON header line followed by the raw body), so a
+    shard is a plain concatenated .gz file and any member can be read on
+    its own by offset, WARC style. index.jsonl has one line per member:
+      { key, url, sha256, shard, offset, length, status, headers, fetched_at }
+    The last line for a key wins; a { key, deleted: true, fetched_at } line
+    (see discard) removes the page. Bodies are addressed by their sha256, and
+    a page whose content hasn't changed since it was archived isn't stored again.
+    """
+    def __init__(self, folder: str = ARCHIVE_FOLDER, shard_count: int = SHARD_COUNT, compresslevel: int = 6):
+        self.folder = Path(folder)
+        self.shard_count = shard_count
+        self.compresslevel = compresslevel
+        self.entries = {}  # key -> latest index entry
+        self.lock = threading.Lock()
+
+        self._shards = {}  # shard number -> open append handle
+        self._index = None
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    def put(self, key: str, url: str, content: bytes, status: int = 200, headers: dict = None) -> bool:
+        """
+        Archive one fetched page. Returns False when the same content is
+        already archived for this key.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            previous = self.entries.get(key)
+            if previous is not None and previous["sha256"] == digest:
+                return False
+
+        header = {"key": key, "url": url, "sha256": digest, "status": status,
+                  "headers": dict(headers or {}), "fetched_at": time.time()}
+        member = gzip.compress(json.dumps(header).encode("utf-8") + b"\n" + content, self.compresslevel)
+
+        shard = shard_of(key, self.shard_count)
+        with self.lock:
+            handle = self._shard_handle(shard)
+            offset = handle.tell()
+            handle.write(member)
+            handle.flush()
+            entry = {**header, "shard": shard, "offset": offset, "length": len(member)}
+            self._index_handle().write(json.dumps(entry) + "\n")
+            self.entries[key] = entry
+        return True
+
+    def discard(self, key: str) -> bool:
+        """
+        Forget a page (e.g. deleted on the wiki) by appending a tombstone to
+        the index; its body stays in the shard but is no longer listed.
+        Returns False when the page isn't archived.
+        """
+        with self.lock:
+            if self.entries.pop(key, None) is None:
+                return False
+            self._index_handle().write(json.dumps({"key": key, "deleted": True, "fetched_at": time.time()}) + "\n")
+        return True
+
+    def get(self, key: str) -> tuple:
+        """
+        Return (index entry, content) of the latest archived copy of key, or (None, None).
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, None
+        with open(self.shard_path(entry["shard"]), "rb") as f:
+            return entry, read_member(f, entry)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def shard_path(self, shard: int) -> Path:
+        return self.folder / SHARD_TEMPLATE.format(shard)
+
+    def shard_entries(self, shard: int) -> list:
+        """
+        Latest index entries stored in one shard, in file order.
+        """
+        return sorted((e for e in self.entries.values() if e["shard"] == shard), key=lambda e: e["offset"])
+
+    def iter_shard(self, shard: int):
+        """
+        Yield (key, url, content) for the latest copy of every page in one
+        shard, reading the shard front to back.
+        """
+        yield from iter_members(self.shard_path(shard), self.shard_entries(shard))
+
+    def close(self):
+        with self.lock:
+            for handle in self._shards.values():
+                handle.close()
+            self._shards = {}
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _shard_handle(self, shard: int):
+        if shard not in self._shards:
+            self._shards[shard] = open(self.shard_path(shard), "ab")
+        return self._shards[shard]
+
+    def _index_handle(self):
+        if self._index is None:
+            ## line buffered, a crash loses at most the line being written
+            self._index = open(self.folder / INDEX_FILE, "a", encoding="utf-8", buffering=1)
+        return self._index
+
+    def _load_index(self):
+        path = self.folder / INDEX_FILE
+        if not path.is_file():
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partial last line of an interrupted run
+                if entry.get("deleted"):
+                    self.entries.pop(entry["key"], None)
+                else:
+                    self.entries[entry["key"]] = entry
@@ -0,0 +1,85 @@
+import json
+from urllib.parse import quote
+
+import requests
+
+API_URL = 'https://starwars.fandom.com/api.php'
+RC_LIMIT = 500  # the most an anonymous client may ask for per request
+
+
+def title_to_key(title: str) -> str:
+    """
+    Page title as it appears in wiki links (and so in our page keys),
+    e.g. 'Padmé Amidala' -> 'Padm%C3%A9_Amidala'. Mirrors MediaWiki's wfUrlencode.
+    """
+    return quote(title.replace(' ', '_'), safe=";@$!*(),/~:")
+
+
+def fetch_recent_changes(since: str, api_url: str = API_URL, session: requests.Session = None) -> tuple:
+    """
+    (changed, deleted) keys of the main namespace pages since an ISO 8601
+    timestamp, read from the MediaWiki recent changes API
+    (list=recentchanges), following continuation. Edits, creations and
+    restored pages count as changed, deletion log entries as deleted.
+    Renames aren't followed: the new title shows up as changed once it is
+    in the page list, the old one stays until the next full crawl.
+    """
+    session = session or requests.Session()
+    params = {
+        "action": "query",
+        "list": "recentchanges",
+        "rcnamespace": 0,
+        "rctype": "edit|new|log",
+        "rcprop": "title|timestamp|loginfo",
+        "rcdir": "newer",
+        "rcstart": since,
+        "rclimit": RC_LIMIT,
+        "format": "json",
+    }
+    changes = []
+    while True:
+        response = session.get(api_url, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        changes.extend(data.get("query", {}).get("recentchanges", []))
+        if "continue" not in data:
+            return split_changes(changes)
+        params.update(data["continue"])
+
+
+def split_changes(changes: list) -> tuple:
+    """
+    (changed, deleted) keys of a list of recent changes, oldest first: a
+    page's last change decides which set it ends up in. Plain titles count
+    as changed.
+    """
+    changed, deleted = set(), set()
+    for change in changes:
+        if not isinstance(change, dict):
+            change = {"title": change}
+        key = title_to_key(change["title"])
+        if change.get("type") == "log" and change.get("logtype") != "delete":
+            continue  # moves, uploads, protections ... don't change the text
+        if change.get("logaction") == "delete":
+            changed.discard(key)
+            deleted.add(key)
+        else:
+            deleted.discard(key)
+            changed.add(key)
+    return changed, deleted
+
+
+def load_changes_file(path: str) -> tuple:
+    """
+    Local stand-in for the feed: either a saved recent changes API response
+    (JSON) or a text file with one page title per line. Returns (changed, deleted).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return split_changes([line.strip() for line in text.splitlines() if line.strip()])
+    if isinstance(data, dict):
+        data = data.get("query", {}).get("recentchanges", [])
+    return split_changes(data)
@@ -0,0 +1,89 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+from tqdm import tqdm
+
+from util_fetch import AsyncFetcher
+from util_parse import init_worker, parse_page
+
+
+def rebase_url(page_url: str, base_url: str = None) -> str:
+    """
+    Point a wiki url at another server (e.g. http://localhost:8000 serving
+    fixture pages), keeping the path and query.
+    """
+    if not base_url:
+        return page_url
+    base = urlsplit(base_url)
+    url = urlsplit(page_url)
+    return urlunsplit((base.scheme, base.netloc, base.path.rstrip('/') + url.path, url.query, ''))
+
+
+def crawl(pages: dict, on_record, fetcher: AsyncFetcher = None, page_keys=None, base_url: str = None,
+          parse_workers: int = None, drop_empty: bool = True, archive=None, state=None,
+          conditional: bool = False, journal=None) -> dict:
+    """
+    Fetch and parse { key: page_url }, calling on_record(record) in the
+    main process for every parsed page. Pages are fetched concurrently by
+    the fetcher while a process pool parses the ones already downloaded.
+    With an HtmlArchive, the raw HTML of every fetched page is kept there too.
+
+    With a CrawlState, each page's ETag / Last-Modified and body hash are
+    recorded. When conditional is set, requests carry the stored validators
+    and pages that come back 304 (or with an unchanged body) are skipped
+    without parsing or calling on_record.
+
+    With a Journal, every parsed record, empty page and failure is appended
+    to it as soon as it is known.
+    Returns { key: page_url } of the pages that failed.
+    """
+    fetcher = fetcher or AsyncFetcher()
+    failed = {}
+    unchanged = []
+    progress = tqdm(total=len(pages))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        keys = page_keys if page_keys is not None else pages.keys()
+        with ProcessPoolExecutor(max_workers=parse_workers or os.cpu_count(),
+                                 initializer=init_worker, initargs=(set(keys),)) as pool:
+
+            async def handle(key, url, result):
+                try:
+                    if result.error is not None:
+                        raise RuntimeError(result.error)
+                    if conditional and (result.status == 304 or state.is_unchanged(key, result.content)):
+                        unchanged.append(key)
+                        progress.update(1)
+                        return
+                    if archive is not None:
+                        ## compression releases the GIL, keep it off the event loop
+                        await loop.run_in_executor(None, archive.put, key, pages[key], result.content,
+                                                   result.status, result.headers)
+                    record = await loop.run_in_executor(pool, parse_page, key, pages[key], result.content, drop_empty)
+                    if record is not None:
+                        on_record(record)
+                    if journal is not None:
+                        journal.done(key, record) if record is not None else journal.empty(key)
+                    if state is not None:
+                        state.record(key, result.headers, result.content)
+                except Exception as e:
+                    print(f'Failed! {key}: {e}')
+                    failed[key] = pages[key]
+                    if journal is not None:
+                        journal.failed(key, pages[key], str(e))
+                progress.update(1)
+
+            items = (
+                (key, rebase_url(page_url, base_url), state.conditional_headers(key) if conditional else None)
+                for key, page_url in pages.items()
+            )
+            await fetcher.run(items, handle)
+
+    asyncio.run(run())
+    progress.close()
+    if conditional:
+        print(f"{len(unchanged)} pages unchanged since the last crawl")
+    return failed
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import time
+
+STATE_FILE_PATH = './Dataset/crawl_state.json'
+
+
+def utc_now() -> str:
+    """
+    Current time in the ISO 8601 form MediaWiki uses for timestamps.
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class CrawlState:
+    """
+    What the last crawl saw for every page, so the next one only has to
+    fetch and parse pages that changed:
+      pages: key -> { etag, last_modified, sha256 }
+      last_crawl: start time of the last crawl that finished
+      failed: key -> url of the pages that crawl couldn't fetch or parse,
+              retried by the next --incremental run whatever the feed says
+    Sent back as If-None-Match / If-Modified-Since, servers answer 304 for
+    unchanged pages. The body hash catches servers that ignore them.
+    """
+    def __init__(self, state_file_path: str = STATE_FILE_PATH):
+        self.state_file_path = state_file_path
+        self.pages = {}
+        self.last_crawl = None
+        self.failed = {}
+
+        self._load_from_disk()
+
+    def conditional_headers(self, key: str) -> dict:
+        page = self.pages.get(key)
+        if page is None:
+            return {}
+        headers = {}
+        if page.get("etag"):
+            headers["If-None-Match"] = page["etag"]
+        if page.get("last_modified"):
+            headers["If-Modified-Since"] = page["last_modified"]
+        return headers
+
+    def is_unchanged(self, key: str, content: bytes) -> bool:
+        page = self.pages.get(key)
+        return page is not None and page.get("sha256") == hashlib.sha256(content).hexdigest()
+
+    def record(self, key: str, headers: dict, content: bytes):
+        ## aiohttp header names are case-insensitive, a plain dict copy is not
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        self.pages[key] = {
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "sha256": hashlib.sha256(content).hexdigest(),
+        }
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.pages
+
+    def _load_from_disk(self):
+        """
+        Load the state from disk (JSON) if it exists.
+        """
+        if os.path.isfile(self.state_file_path):
+            try:
+                with open(self.state_file_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.pages = data.get("pages", {})
+                self.last_crawl = data.get("last_crawl")
+                self.failed = data.get("failed", {})
+            except Exception as e:
+                print(f"[CrawlState] Warning: Could not load state from disk: {e}")
+
+    def forget(self, key: str):
+        """
+        Drop a page that no longer exists.
+        """
+        self.pages.pop(key, None)
+        self.failed.pop(key, None)
+
+    def save(self, last_crawl: str = None, failed: dict = None):
+        """
+        Write the state to disk in one step, optionally marking a finished
+        crawl and the pages it failed on.
+        """
+        if last_crawl is not None:
+            self.last_crawl = last_crawl
+        if failed is not None:
+            self.failed = dict(failed)
+        tmp_path = f"{self.state_file_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"last_crawl": self.last_crawl, "failed": self.failed, "pages": self.pages}, f)
+            os.replace(tmp_path, self.state_file_path)
+        except Exception as e:
+            print(f"[CrawlState] Error: Could not persist state to disk: {e}")
@@ -0,0 +1,131 @@
+import asyncio
+import random
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utility.util_rate_limit import TokenBucket
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class FetchResult:
+    url: str
+    status: int                       # HTTP status, 0 when every attempt failed without a response
+    content: bytes = b""
+    headers: dict = field(default_factory=dict)
+    error: str = None
+
+
+class AsyncFetcher:
+    """
+    Fetches many pages over one shared keep-alive connection pool.
+
+      - at most `concurrency` requests are in flight
+      - each host gets its own token bucket of `rate_per_host` requests/s
+      - connection errors, timeouts, 429 and 5xx responses are retried with
+        exponential backoff and full jitter (429 honors Retry-After)
+
+    Nothing here is specific to the wiki, so it can be pointed at a local
+    `python -m http.server` serving saved pages.
+    """
+    def __init__(self, concurrency: int = 16, rate_per_host: float = 5.0, burst: int = 10,
+                 max_retries: int = 5, base_backoff: float = 1.0, max_backoff: float = 60.0,
+                 timeout: float = 30.0, headers: dict = None):
+        self.concurrency = concurrency
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.buckets = {}  # host -> TokenBucket
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate_per_host, self.burst)
+        return self.buckets[host]
+
+    def _backoff(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, headers: dict = None) -> FetchResult:
+        """
+        GET one url, retrying transient failures. Never raises for HTTP or
+        network errors; check FetchResult.status / .error instead.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            await self._bucket(url).acquire_async()
+            try:
+                async with session.get(url, headers=headers) as response:
+                    content = await response.read()
+                    if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        error = f"HTTP {response.status}"
+                        await asyncio.sleep(self._backoff(attempt, response.headers.get("Retry-After")))
+                        continue
+                    return FetchResult(url, response.status, content, dict(response.headers),
+                                       None if response.status < 400 else f"HTTP {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt))
+        return FetchResult(url, 0, error=error)
+
+    async def run(self, items, handle):
+        """
+        Fetch every (key, url) or (key, url, request headers) in items and
+        await handle(key, url, result) for each one as it completes. Handlers run as their own tasks (at most
+        2 x concurrency at once), so fetch slots are freed while a handler
+        waits on CPU work it handed to an executor, e.g. parsing.
+        """
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        handler_slots = asyncio.Semaphore(self.concurrency * 2)
+        handlers = set()
+
+        async def run_handler(key, url, result):
+            try:
+                await handle(key, url, result)
+            finally:
+                handler_slots.release()
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers) as session:
+            async def worker():
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        return
+                    key, url, *headers = item
+                    result = await self.fetch(session, url, headers[0] if headers else None)
+                    await handler_slots.acquire()
+                    task = asyncio.create_task(run_handler(key, url, result))
+                    handlers.add(task)
+                    task.add_done_callback(handlers.discard)
+
+            async def produce():
+                for item in items:
+                    await queue.put(item)
+                for _ in range(self.concurrency):
+                    await queue.put(None)
+
+            tasks = [asyncio.create_task(produce())] + [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*tasks)
+                await asyncio.gather(*list(handlers))
+            except BaseException:
+                ## stop the others instead of leaving them blocked on the queue
+                for task in tasks + list(handlers):
+                    task.cancel()
+                await asyncio.gather(*tasks, *list(handlers), return_exceptions=True)
+                raise
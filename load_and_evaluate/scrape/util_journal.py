@@ -0,0 +1,119 @@
+import json
+import os
+import time
+
+JOURNAL_FILE_PATH = './Dataset/scrape_journal.jsonl'
+FLUSH_EVERY = 100       # entries buffered before they are written and fsynced
+FLUSH_INTERVAL = 5.0    # seconds, so a slow crawl still reaches disk often
+
+
+class Journal:
+    """
+    Append-only write-ahead journal of a crawl, one JSON line per page:
+      { "op": "done",   "key", "record" }   parsed record
+      { "op": "empty",  "key" }             fetched, but no article on the page
+      { "op": "failed", "key", "url", "error" }
+    Entries are flushed and fsynced in small batches, so a crash loses at
+    most the last batch. A resumed crawl skips keys that are done or empty
+    and retries the failed ones; the partitions are compacted from the
+    journal once the crawl is over.
+    """
+    def __init__(self, journal_file_path: str = JOURNAL_FILE_PATH, flush_every: int = FLUSH_EVERY,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.journal_file_path = journal_file_path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self._file = None
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def done(self, key: str, record: dict):
+        self._append({"op": "done", "key": key, "record": record})
+
+    def empty(self, key: str):
+        self._append({"op": "empty", "key": key})
+
+    def failed(self, key: str, url: str, error: str):
+        self._append({"op": "failed", "key": key, "url": url, "error": error})
+
+    def reset(self):
+        """
+        Start a new crawl, dropping the entries of the previous one.
+        """
+        self.close()
+        open(self.journal_file_path, "w").close()
+
+    def entries(self):
+        """
+        Replay the journal. A partial last line from a crash is ignored.
+        """
+        if not os.path.isfile(self.journal_file_path):
+            return
+        with open(self.journal_file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def status(self) -> tuple:
+        """
+        Returns (completed keys, { key: url } of keys whose last attempt failed).
+        """
+        completed = set()
+        failed = {}
+        for entry in self.entries():
+            if entry["op"] == "failed":
+                failed[entry["key"]] = entry["url"]
+            else:
+                completed.add(entry["key"])
+                failed.pop(entry["key"], None)
+        return completed, failed
+
+    def records(self):
+        """
+        Stream the parsed records, the latest one per key.
+        """
+        latest = {}
+        for line_number, entry in enumerate(self.entries()):
+            if entry["op"] == "done":
+                latest[entry["key"]] = line_number
+        for line_number, entry in enumerate(self.entries()):
+            if entry["op"] == "done" and latest[entry["key"]] == line_number:
+                yield entry["record"]
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._file = open(self.journal_file_path, "a", encoding="utf-8")
+            if self._file.tell() > 0 and not self._ends_with_newline():
+                self._file.write("\n")  # end the partial line a crash left behind
+        self._file.write("".join(self._buffer))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.journal_file_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _append(self, entry: dict):
+        self._buffer.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
@@ -0,0 +1,197 @@
+import re
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import lxml.html
+from lxml import etree
+
+## Page ids known to the crawl, used to keep only cross-links to canon pages.
+## Set once per worker process by init_worker so it isn't pickled per page.
+page_keys = set()
+
+BRACKETS_RE = re.compile(r"[\(\[].*?[\)\]]")  # citations like [1] and asides like (canon)
+NON_WORD_RE = re.compile(r'\W+')
+
+SKIPPED_SECTIONS = {"## Appearances", "## Sources", "## Notes and references", "## External links"}
+
+## wiki pages are served as UTF-8; bs4 sniffed this, lxml has to be told
+HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+
+def _class_xpath(tag: str, class_name: str, axis: str = ".//") -> etree.XPath:
+    ## matches class_name as one of the element's classes, like bs4's class_=
+    return etree.XPath(f"{axis}{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]")
+
+
+FIND_HEADING = etree.XPath("//h1[@id='firstHeading']")
+FIND_SIDEBAR_SECTIONS = _class_xpath("section", "pi-item", axis="//")
+FIND_SIDEBAR_ITEMS = _class_xpath("div", "pi-item")
+FIND_SECTION_TITLE = etree.XPath(".//h2")
+FIND_DATA_LABEL = _class_xpath("h3", "pi-data-label")
+FIND_DATA_VALUE = _class_xpath("div", "pi-data-value")
+FIND_CONTENT = _class_xpath("div", "mw-parser-output", axis="//")
+FIND_HEADLINE = _class_xpath("span", "mw-headline")
+FIND_ASIDES = etree.XPath(".//aside")
+FIND_LINK_HREFS = etree.XPath(".//a/@href")
+
+
+def init_worker(keys):
+    """
+    ProcessPoolExecutor initializer: share the set of known page ids with the worker.
+    """
+    global page_keys
+    page_keys = set(keys)
+
+
+def _first(xpath: etree.XPath, element):
+    found = xpath(element)
+    return found[0] if found else None
+
+
+def _text(element) -> str:
+    return element.text_content()
+
+
+def parse_sidebar(root) -> tuple:
+    """
+    Extract the infobox ('pi-item' sections) as (side_bar, side_bar_meta).
+    """
+    side_bar = {}
+    side_bar_meta = {'is_character': False}
+    for s in FIND_SIDEBAR_SECTIONS(root):
+        title = _first(FIND_SECTION_TITLE, s)
+        if title is None:
+            title = '<no category>'
+            m_title = ""
+        else:
+            title = _text(title)
+            m_title = NON_WORD_RE.sub('_', title.lower()).strip('_')
+        side_bar[title] = {}
+        for item in FIND_SIDEBAR_ITEMS(s):
+            attr = _first(FIND_DATA_LABEL, item)
+            if attr is None:
+                attr = '<no attribute>'
+                m_attr = 'no_attribute'
+            else:
+                attr = _text(attr)
+                m_attr = NON_WORD_RE.sub('_', attr.lower()).strip('_')
+            if attr == 'Species':
+                side_bar_meta['is_character'] = True
+            value = BRACKETS_RE.sub('', '], '.join(_text(_first(FIND_DATA_VALUE, item)).split(']')))
+            value = value.strip()[:-1].replace(',,', ',')
+            if ',' in value:
+                value = [i.strip() for i in value.split(',') if i.strip() != '']
+            side_bar[title][attr] = value
+            side_bar_meta["_".join([m_title, m_attr])] = value
+    return side_bar, side_bar_meta
+
+
+def parse_content(root, heading: str, key: str) -> tuple:
+    """
+    Split the article body ('mw-parser-output') into (lore_pgs, behind_the_scenes_pgs, keywords).
+    """
+    raw_content = _first(FIND_CONTENT, root)
+    keywords = []
+    lore_pgs = []
+    behind_the_scenes_pgs = []
+    if raw_content is None:
+        return lore_pgs, behind_the_scenes_pgs, keywords
+
+    lore_pgs.append(f"# {heading.strip()}")
+    write_to_lore = True
+    for child in raw_content.iterchildren(tag=etree.Element):
+
+        ##remove asides (keeping the text that follows them)
+        for aside in FIND_ASIDES(child):
+            aside.drop_tree()
+
+        # Handle <h2> tags
+        if child.tag == 'h2':
+            headline = _first(FIND_HEADLINE, child)
+            if headline is not None:
+                appending = f"## {_text(headline).strip()}"
+                if appending == "## Behind the scenes":
+                    write_to_lore = False
+                if appending in SKIPPED_SECTIONS:
+                    continue
+                lore_pgs.append(appending) if write_to_lore else behind_the_scenes_pgs.append(appending)
+
+        # Handle <p> tags
+        elif child.tag == 'p':
+            cleaned_paragraph = BRACKETS_RE.sub('', _text(child).strip())
+            lore_pgs.append(cleaned_paragraph) if write_to_lore else behind_the_scenes_pgs.append(cleaned_paragraph)
+
+    # Cross-links
+    for href in FIND_LINK_HREFS(raw_content):
+        part = href.split('/')[-1]
+        if part in page_keys and part != key:
+            keywords.append(part)
+    keywords = list(set(keywords))
+
+    return lore_pgs, behind_the_scenes_pgs, keywords
+
+
+def parse_page(key: str, page_url: str, content: bytes, drop_empty: bool = True) -> dict:
+    """
+    Parse a fetched Wookieepedia page into a record in the load_data.py schema.
+    Returns None when the page has no h1 firstHeading. With drop_empty, empty
+    lore / behind_the_scenes fields are left out of the record.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    root = lxml.html.document_fromstring(content, parser=HTML_PARSER)
+
+    # Get title
+    heading = _first(FIND_HEADING, root)
+    if heading is None:
+        print(f"page had no h1 firstHeading {page_url}")
+        return None
+    heading = _text(heading)
+
+    side_bar, side_bar_meta = parse_sidebar(root)
+    lore_pgs, behind_the_scenes_pgs, keywords = parse_content(root, heading, key)
+
+    # Data object
+    record = {
+        'id': key,
+        'url': page_url,
+        'title': heading.strip(),
+        'side_bar_json': json.dumps(side_bar),
+        'metadata': side_bar_meta,
+        'lore': "\n\n".join(lore_pgs),
+        'behind_the_scenes': "\n\n".join(behind_the_scenes_pgs),
+        'crosslinked_keywords': keywords,
+    }
+
+    if drop_empty:
+        if record['lore'] == "":
+            del record['lore']
+        if record['behind_the_scenes'] == "":
+            del record['behind_the_scenes']
+
+    return record
+
+
+def _parse_item(item: tuple) -> dict:
+    key, page_url, content, drop_empty = item
+    return parse_page(key, page_url, content, drop_empty)
+
+
+def parse_pages(items, keys, workers: int = None, drop_empty: bool = True, chunksize: int = 16):
+    """
+    Parse an iterable of (key, page_url, content) on a process pool, yielding
+    records (None for pages without a heading) in input order. For pages
+    already on disk; the crawler feeds the pool page by page as they arrive.
+    """
+    workers = workers or os.cpu_count()
+    window_size = workers * chunksize * 4  # pages held in memory at once
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(set(keys),)) as pool:
+        window = []
+        for key, page_url, content in items:
+            window.append((key, page_url, content, drop_empty))
+            if len(window) >= window_size:
+                yield from pool.map(_parse_item, window, chunksize=chunksize)
+                window = []
+        if window:
+            yield from pool.map(_parse_item, window, chunksize=chunksize)
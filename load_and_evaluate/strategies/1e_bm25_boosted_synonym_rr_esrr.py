@@ -1,6 +1,7 @@
 
 from utility.util_es import search_to_context
-from utility.util_llm import LLMUtil
+from utility.util_context_pack import pack_context, CONTEXT_TOKEN_BUDGET
+from utility.util_llm import LLMUtil, RAG_PROMPT_TEMPLATE
 import unicodedata
 
 def is_disabled() -> bool:
@@ -8,7 +9,9 @@ def is_disabled() -> bool:
 
 def get_parameters() -> dict:
     return {
-        "index_name": "star_wars_simple"
+        "index_name": "star_wars_simple",
+        "rag_context_mode": "passages",
+        "context_token_budget": 3000,
     }
 
 
@@ -52,23 +55,11 @@ def retrieve_context(es, query_string: str):
     index_name = get_parameters()['index_name']
     body = build_query(query_string)
     rag_context = get_parameters().get("rag_context", "lore")
-    return search_to_context(es, index_name, body, rag_context, 3)
+    rag_context_mode = get_parameters().get("rag_context_mode", "document")
+    context = search_to_context(es, index_name, body, rag_context, 3, rag_context_mode)
+    return pack_context(context, get_parameters().get("context_token_budget", CONTEXT_TOKEN_BUDGET))
 
 
 def rag(llm_util : LLMUtil, query_string: str, retrieval_context) -> str :
 
-    context = "\n\n".join(retrieval_context)
-    system_prompt = f"""
-Instructions:
-  
-  - You are an assistant for question-answering tasks.
-  - Answer questions truthfully and factually using only the context presented.
-  - If you don't know the answer, just say that you don't know, don't make up an answer.
-  - You are correct, factual, precise, and reliable.
-
-
-  Context:
-  {context}
-"""
-    
-    return llm_util.rag_cache(system_prompt, retrieval_context, query_string)
\ No newline at end of file
+    return llm_util.rag_cache(RAG_PROMPT_TEMPLATE, retrieval_context, query_string)
\ No newline at end of file
@@ -0,0 +1,241 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from utility.util_cache_store import SqliteCacheStore, CACHE_DB_PATH
+from utility.util_single_flight import SingleFlight, AsyncSingleFlight
+
+## Budgets per cache namespace. None means unbounded.
+##   memory_*: in-process LRU tier, fast but private to the process
+##   disk_*:   shared SQLite tier (utility/util_cache_store.py)
+##   ttl:      seconds an entry stays valid, None to keep it until evicted
+CACHE_CONFIG = {
+    "rag": {
+        "memory_entries": 2000, "memory_bytes": 32 * 1024 * 1024,
+        "disk_entries": None, "disk_bytes": 2 * 1024 * 1024 * 1024,
+        "ttl": None,
+    },
+    "query_transform": {
+        "memory_entries": 10000, "memory_bytes": 8 * 1024 * 1024,
+        "disk_entries": None, "disk_bytes": 256 * 1024 * 1024,
+        "ttl": None,
+    },
+}
+
+
+class MemoryTier:
+    """
+    In-process LRU tier bounded by entry count and by the total encoded
+    size of its values.
+    """
+    name = "memory"
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, stored_at, size)
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key, last=True)
+            return entry[0], entry[1]
+
+    def put(self, key: str, value, stored_at: float = None) -> int:
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[2]
+            self.entries[key] = (value, stored_at or time.time(), size)
+            self.bytes += size
+            return self._evict()
+
+    def delete(self, key: str):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[2]
+
+    def size_bytes(self) -> int:
+        return self.bytes
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _evict(self) -> int:
+        evicted = 0
+        while self.entries and ((self.max_entries is not None and len(self.entries) > self.max_entries) or
+                                (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, _, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            evicted += 1
+        return evicted
+
+
+class TieredCache:
+    """
+    A namespaced cache over an ordered list of tiers (fastest first), e.g.
+    [MemoryTier, SqliteCacheStore]. Any object with get(key) ->
+    (value, stored_at) | None, put(key, value, stored_at) -> evicted count
+    and delete(key) can be a tier.
+
+    A get walks the tiers in order and copies a hit found in a slower tier
+    into the faster ones. A put writes to every tier. Entries older than
+    ttl seconds count as misses and are removed. Hits, misses, puts,
+    evictions and expirations are counted per namespace (see cache_stats()).
+
+    get_or_load / get_or_load_async fill misses through a single flight, so
+    concurrent misses on one key make one call and share its result
+    ("coalesced" in the stats). A failed load is not cached.
+    """
+    def __init__(self, namespace: str, tiers: list, ttl: float = None):
+        self.namespace = namespace
+        self.tiers = tiers
+        self.ttl = ttl
+        self.counters = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0, "expirations": 0}
+        self.tier_hits = {tier.name: 0 for tier in tiers}
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.async_flight = AsyncSingleFlight()
+        register_cache(self)
+
+    def get(self, key: str, count: bool = True):
+        """
+        Return the cached value, or None on a miss. With count=False the
+        lookup is left out of the hit/miss counters.
+        """
+        for ix, tier in enumerate(self.tiers):
+            entry = tier.get(key)
+            if entry is None:
+                continue
+            value, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                for expired_tier in self.tiers:
+                    expired_tier.delete(key)
+                self._count("expirations")
+                break
+            ## promote into the faster tiers, keeping the original store time for the TTL
+            for faster in self.tiers[:ix]:
+                self._count("evictions", faster.put(key, value, stored_at))
+            if count:
+                self._count("hits")
+                with self.lock:
+                    self.tier_hits[tier.name] += 1
+            return value
+        if count:
+            self._count("misses")
+        return None
+
+    def get_or_load(self, key: str, load):
+        """
+        Return the cached value, or call load() once for all the threads
+        missing on key at the same time, cache its result and return it.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        return self.flight.do(key, self._load, key, load)
+
+    async def get_or_load_async(self, key: str, load):
+        """
+        get_or_load for coroutines: load is an async function.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        return await self.async_flight.do(key, self._load_async, key, load)
+
+    def _load(self, key: str, load):
+        ## a flight that finished between our miss and this one may have stored it
+        value = self.get(key, count=False)
+        if value is None:
+            value = load()
+            self.put(key, value)
+        return value
+
+    async def _load_async(self, key: str, load):
+        value = self.get(key, count=False)
+        if value is None:
+            value = await load()
+            self.put(key, value)
+        return value
+
+    def put(self, key: str, value):
+        stored_at = time.time()
+        for tier in self.tiers:
+            self._count("evictions", tier.put(key, value, stored_at))
+        self._count("puts")
+
+    def delete(self, key: str):
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+            tier_hits = dict(self.tier_hits)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "coalesced": self.flight.shared + self.async_flight.shared,
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            "tier_hits": tier_hits,
+            "tiers": {tier.name: {"entries": len(tier), "bytes": tier.size_bytes()} for tier in self.tiers},
+        }
+
+    def _count(self, counter: str, amount: int = 1):
+        if amount:
+            with self.lock:
+                self.counters[counter] += amount
+
+
+def make_cache(namespace: str, db_path: str = CACHE_DB_PATH, legacy_json_path: str = None) -> TieredCache:
+    """
+    Build the standard memory + SQLite cache for a namespace from CACHE_CONFIG.
+    """
+    config = CACHE_CONFIG.get(namespace, {})
+    return TieredCache(namespace, [
+        MemoryTier(config.get("memory_entries"), config.get("memory_bytes")),
+        SqliteCacheStore(namespace, db_path, config.get("disk_entries"), config.get("disk_bytes"),
+                         legacy_json_path=legacy_json_path),
+    ], ttl=config.get("ttl"))
+
+
+## Every cache created in this process (anything with a namespace and stats()), for cache_stats()
+_caches = []
+_caches_lock = threading.Lock()
+
+
+def register_cache(cache: TieredCache):
+    with _caches_lock:
+        _caches.append(cache)
+
+
+def cache_stats() -> dict:
+    """
+    { namespace: stats } for every cache in this process.
+    """
+    with _caches_lock:
+        caches = list(_caches)
+    stats = {}
+    for cache in caches:
+        name = cache.namespace
+        while name in stats:
+            name += "'"  # a second cache over the same namespace
+        stats[name] = cache.stats()
+    return stats
+
+
+def print_cache_stats():
+    for namespace, stats in cache_stats().items():
+        audit = (f"audited={stats['audited']} false_hit_rate={stats['false_hit_rate']:.1%} "
+                 if "audited" in stats else "")
+        print(f"[cache:{namespace}] hits={stats['hits']} misses={stats['misses']} hit_rate={stats['hit_rate']:.1%} "
+              f"coalesced={stats['coalesced']} puts={stats['puts']} evictions={stats['evictions']} expirations={stats['expirations']} "
+              + audit
+              + " ".join(f"{name}={tier['entries']} entries/{tier['bytes'] / 1024 / 1024:.1f}MB"
+                         for name, tier in stats["tiers"].items()))
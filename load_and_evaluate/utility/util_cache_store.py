@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DB_PATH = os.getenv("LLM_CACHE_DB", "llm_cache.sqlite")
+BUSY_TIMEOUT_MS = 30000  # how long a writer waits for another process's transaction
+EVICT_EVERY = 100        # puts between eviction sweeps
+ACCESS_RESOLUTION = 60   # seconds; a read only refreshes an entry's LRU time when it is older than this
+ACCESS_FLUSH_EVERY = 30  # seconds between batched writes of refreshed LRU times
+BLOB_GRACE_SECONDS = 3600  # unreferenced blobs younger than this survive a collect (their entry may not be stored yet)
+
+
+class SqliteCacheStore:
+    """
+    Persistent key -> JSON value store shared by the LLM caches, one
+    namespace per cache, in a single SQLite file in WAL mode. Used as the
+    disk tier of a TieredCache (utility/util_cache.py).
+
+      - every put is its own small transaction, so a crash loses nothing
+        that was already returned to a caller
+      - any number of threads and processes can read and write at once
+        (WAL readers never block, writers wait up to BUSY_TIMEOUT_MS)
+      - the database is opened lazily, per thread and per process, so
+        importing a strategy costs nothing and forked workers get their
+        own connection
+      - past max_entries entries or max_bytes of values, the least
+        recently used entries are evicted. Reads stay read-only: access
+        times are buffered and written in one batch every
+        ACCESS_FLUSH_EVERY seconds (and before each eviction sweep), so
+        the LRU order is approximate to about a minute
+    """
+    name = "sqlite"
+
+    def __init__(self, namespace: str, db_path: str = CACHE_DB_PATH, max_entries: int = None,
+                 max_bytes: int = None, legacy_json_path: str = None):
+        self.namespace = namespace
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.legacy_json_path = legacy_json_path
+
+        self._local = threading.local()
+        self._puts = 0
+        self._accessed = {}  # key -> access time not written yet
+        self._accessed_flushed = time.time()
+        self._lock = threading.Lock()
+        self.on_evict = None  # called with the count after a sweep that evicted something
+
+    def get(self, key: str):
+        """
+        Returns (value, stored_at) or None.
+        """
+        row = self._conn().execute("SELECT value, stored, accessed FROM cache WHERE namespace = ? AND key = ?",
+                                   (self.namespace, key)).fetchone()
+        if row is None:
+            return None
+        if self._bounded() and time.time() - row[2] > ACCESS_RESOLUTION:
+            self._touch(key)
+        return json.loads(row[0]), row[1]
+
+    def put(self, key: str, value, stored_at: float = None) -> int:
+        """
+        Store value. Returns the number of entries evicted to make room.
+        """
+        encoded = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO cache (namespace, key, value, size, stored, accessed) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (self.namespace, key, encoded, len(encoded.encode("utf-8")), stored_at or now, now))
+        with self._lock:
+            self._puts += 1
+            sweep = self._bounded() and self._puts % EVICT_EVERY == 0
+        return self.evict() if sweep else 0
+
+    def delete(self, key: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def evict(self) -> int:
+        """
+        Drop the least recently used entries beyond max_entries / max_bytes.
+        Returns how many were dropped.
+        """
+        self.flush_accessed()
+        evicted = 0
+        conn = self._conn()
+        with conn:
+            if self.max_entries is not None:
+                evicted += conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key IN "
+                    "(SELECT key FROM cache WHERE namespace = ? ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.namespace, self.namespace, self.max_entries)
+                ).rowcount
+            if self.max_bytes is not None:
+                ## running total of sizes from the most recently used entry down
+                evicted += conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key IN "
+                    "(SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS running "
+                    "FROM cache WHERE namespace = ?) WHERE running > ?)",
+                    (self.namespace, self.namespace, self.max_bytes)
+                ).rowcount
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+        return evicted
+
+    def flush_accessed(self):
+        """
+        Write the buffered access times in one transaction.
+        """
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+            self._accessed_flushed = time.time()
+        if not accessed:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("UPDATE cache SET accessed = MAX(accessed, ?) WHERE namespace = ? AND key = ?",
+                             [(at, self.namespace, key) for key, at in accessed.items()])
+
+    def _touch(self, key: str):
+        now = time.time()
+        with self._lock:
+            self._accessed[key] = now
+            due = now - self._accessed_flushed >= ACCESS_FLUSH_EVERY
+        if due:
+            self.flush_accessed()
+
+    def items(self, prefix: str = ""):
+        """
+        Stream (key, value) of every entry whose key starts with prefix.
+        """
+        rows = self._conn().execute("SELECT key, value FROM cache WHERE namespace = ? AND key >= ? ORDER BY key",
+                                    (self.namespace, prefix))
+        for key, value in rows:
+            if not key.startswith(prefix):
+                return
+            yield key, json.loads(value)
+
+    def size_bytes(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM cache WHERE namespace = ?",
+                                    (self.namespace,)).fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM cache WHERE namespace = ? AND key = ?",
+                                    (self.namespace, key)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self.flush_accessed()
+            conn.close()
+            self._local.conn = None
+
+    def _bounded(self) -> bool:
+        return self.max_entries is not None or self.max_bytes is not None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                         "value TEXT NOT NULL, size INTEGER NOT NULL DEFAULT 0, stored REAL NOT NULL DEFAULT 0, "
+                         "accessed REAL NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+            ## databases written before sizes and store times were tracked
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+            if "size" not in columns:
+                conn.execute("ALTER TABLE cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE cache SET size = length(CAST(value AS BLOB))")
+            if "stored" not in columns:
+                conn.execute("ALTER TABLE cache ADD COLUMN stored REAL NOT NULL DEFAULT 0")
+                conn.execute("UPDATE cache SET stored = accessed")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS imported (path TEXT PRIMARY KEY)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        self._import_legacy_json(conn)
+        return conn
+
+    def _import_legacy_json(self, conn: sqlite3.Connection):
+        """
+        One time import of the whole-file JSON cache the LLM caches used to
+        write at exit, so existing answers stay warm.
+        """
+        if not self.legacy_json_path or not os.path.isfile(self.legacy_json_path):
+            return
+        path = os.path.abspath(self.legacy_json_path)
+        if conn.execute("SELECT 1 FROM imported WHERE path = ?", (path,)).fetchone():
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[SqliteCacheStore] Warning: Could not import {path}: {e}")
+            data = {}
+        now = time.time()
+        rows = []
+        for key, value in data.items():
+            encoded = json.dumps(value, ensure_ascii=False)
+            rows.append((self.namespace, key, encoded, len(encoded.encode("utf-8")), now, now))
+        with conn:
+            ## INSERT OR IGNORE: entries written since take precedence over the old file
+            conn.executemany("INSERT OR IGNORE INTO cache (namespace, key, value, size, stored, accessed) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT OR IGNORE INTO imported (path) VALUES (?)", (path,))
+        print(f"[SqliteCacheStore] Imported {len(data)} entries from {path}")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed text store: every text is kept once, under its sha256,
+    however many cache entries refer to it. Texts aren't evicted on their
+    own; collect() drops the ones no entry of the referring namespace lists
+    any more, so the store shrinks with the entries that use it.
+    """
+    def __init__(self, namespace: str = "blobs", db_path: str = CACHE_DB_PATH):
+        self.store = SqliteCacheStore(namespace, db_path)
+
+    def put(self, text: str, digest: str = None) -> str:
+        """
+        Store text unless it is already there. Returns its hash.
+        """
+        digest = digest or content_hash(text)
+        if digest not in self.store:
+            self.store.put(digest, text)
+        return digest
+
+    def get(self, digest: str) -> str:
+        entry = self.store.get(digest)
+        return entry[0] if entry is not None else None
+
+    def collect(self, referenced_by: str, path: str = "$.context", grace: float = BLOB_GRACE_SECONDS) -> int:
+        """
+        Delete the texts that no entry of the referenced_by namespace lists
+        at path (a JSON path into its values), except those stored in the
+        last grace seconds. Returns how many were deleted.
+        """
+        conn = self.store._conn()
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND stored < ? AND key NOT IN "
+                "(SELECT refs.value FROM cache AS entries, json_each(entries.value, ?) AS refs "
+                "WHERE entries.namespace = ?)",
+                (self.store.namespace, time.time() - grace, path, referenced_by)
+            ).rowcount
+        if deleted:
+            print(f"[BlobStore] Dropped {deleted} {self.store.namespace} texts no {referenced_by} entry refers to")
+        return deleted
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,125 @@
+import re
+
+from utility.util_es import ContextPassage
+from utility.util_llm import count_tokens, truncate_to_tokens
+
+CONTEXT_TOKEN_BUDGET = 3000   # context tokens per prompt when a strategy doesn't set "context_token_budget"
+MIN_TRUNCATED_TOKENS = 64     # a paragraph cut shorter than this is dropped instead
+NEAR_DUPLICATE_JACCARD = 0.8  # word trigram overlap above which a paragraph counts as a repeat
+SHINGLE_SIZE = 3
+
+PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def pack_context(passages: list, budget: int = CONTEXT_TOKEN_BUDGET) -> list:
+    """
+    Fit retrieved passages (best first, as search_to_context returns them)
+    into a budget of LLM tokens:
+
+      - passages are split into paragraphs; a paragraph that repeats, or
+        nearly repeats (word trigram Jaccard >= NEAR_DUPLICATE_JACCARD), one
+        already packed is dropped
+      - each passage is first given a share of the budget proportional to
+        its hit's score and keeps whole paragraphs up to that share
+      - what is left over goes to the remaining paragraphs in rank order;
+        the first one that doesn't fit is cut to the space left
+
+    Returns the packed passages in their original order, each still
+    carrying its doc id and score (empty ones are dropped).
+    """
+    paragraphs = []
+    for passage in passages:
+        parts = [part.strip() for part in PARAGRAPH_SPLIT.split(str(passage))]
+        ## + 1 for the blank line joining it to the next one
+        paragraphs.append([(part, count_tokens(part) + 1) for part in parts if part])
+
+    kept = [[] for _ in passages]  # per passage: [text]
+    seen = _Seen()
+    used = 0
+
+    ## 1. whole paragraphs within each passage's score share
+    for ix, share in enumerate(_shares(passages, budget)):
+        spent = 0
+        while paragraphs[ix]:
+            text, tokens = paragraphs[ix][0]
+            if spent + tokens > share:
+                break
+            paragraphs[ix].pop(0)
+            if seen.add(text):
+                kept[ix].append(text)
+                spent += tokens
+        used += spent
+
+    ## 2. the rest of the budget, best passages first
+    for ix in range(len(passages)):
+        while paragraphs[ix] and used < budget:
+            text, tokens = paragraphs[ix].pop(0)
+            if not seen.is_new(text):
+                continue
+            if used + tokens > budget:
+                if budget - used < MIN_TRUNCATED_TOKENS:
+                    break
+                text = truncate_to_tokens(text, budget - used)
+                tokens = budget - used
+            seen.add(text)
+            kept[ix].append(text)
+            used += tokens
+
+    packed = []
+    for passage, texts in zip(passages, kept):
+        if texts:
+            packed.append(ContextPassage("\n\n".join(texts), getattr(passage, "doc_id", None),
+                                         score=getattr(passage, "score", None)))
+    return packed
+
+
+def _shares(passages: list, budget: int) -> list:
+    """
+    Budget per passage, proportional to the hit scores (equal when scores
+    are missing or not positive).
+    """
+    scores = [getattr(passage, "score", None) for passage in passages]
+    if not passages:
+        return []
+    if any(score is None or score <= 0 for score in scores):
+        return [budget // len(passages)] * len(passages)
+    total = sum(scores)
+    return [int(budget * score / total) for score in scores]
+
+
+class _Seen:
+    """
+    Word trigram sets of the paragraphs packed so far, for near-duplicate checks.
+    """
+    def __init__(self):
+        self.exact = set()
+        self.shingles = []
+
+    def is_new(self, text: str) -> bool:
+        words = WORD_PATTERN.findall(text.lower())
+        if " ".join(words) in self.exact:
+            return False
+        shingles = _shingles(words)
+        for other in self.shingles:
+            overlap = len(shingles & other)
+            if overlap and overlap / len(shingles | other) >= NEAR_DUPLICATE_JACCARD:
+                return False
+        return True
+
+    def add(self, text: str) -> bool:
+        """
+        Remember text, unless it repeats a paragraph already seen. Returns whether it was new.
+        """
+        if not self.is_new(text):
+            return False
+        words = WORD_PATTERN.findall(text.lower())
+        self.exact.add(" ".join(words))
+        self.shingles.append(_shingles(words))
+        return True
+
+
+def _shingles(words: list) -> set:
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
@@ -0,0 +1,236 @@
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARTITION_TEMPLATE = "starwars_all_canon_data_{}.parquet"
+PARTITION_GLOB = "starwars_all_canon_data_*.parquet"
+LEGACY_PARTITION_GLOB = "starwars_all_canon_data_*.pickle"
+PARTITION_SIZE = 5000   # records per partition file, same as the old pickle partitions
+ROW_GROUP_SIZE = 500    # records per row group, the unit readers stream and project
+
+
+## Columns of a scraped record, see the schema notes in load_data.py.
+## 'metadata' has different keys on every page, so it is kept as a JSON string
+## and decoded back into a dict when read.
+RECORD_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("url", pa.string()),
+    ("title", pa.string()),
+    ("side_bar_json", pa.string()),
+    ("metadata", pa.string()),
+    ("lore", pa.string()),
+    ("behind_the_scenes", pa.string()),
+    ("crosslinked_keywords", pa.list_(pa.string())),
+])
+RECORD_COLUMNS = RECORD_SCHEMA.names
+
+## fields the scraper drops when empty; a missing value reads back as a missing key
+OPTIONAL_COLUMNS = {"lore", "behind_the_scenes"}
+
+
+def _to_row(record: dict) -> dict:
+    row = {name: record.get(name) for name in RECORD_COLUMNS}
+    if row["metadata"] is not None:
+        row["metadata"] = json.dumps(row["metadata"])
+    return row
+
+
+def _from_row(row: dict) -> dict:
+    record = {}
+    for name, value in row.items():
+        if value is None and name in OPTIONAL_COLUMNS:
+            continue
+        if name == "metadata" and value is not None:
+            value = json.loads(value)
+        record[name] = value
+    return record
+
+
+def _rows_to_batch(rows: list) -> pa.RecordBatch:
+    return pa.RecordBatch.from_pylist(rows, schema=RECORD_SCHEMA)
+
+
+def write_partition(records, path, row_group_size: int = ROW_GROUP_SIZE) -> int:
+    """
+    Write an iterable of records to one zstd-compressed Parquet file,
+    one row group per row_group_size records. Returns the record count.
+    """
+    count = 0
+    with pq.ParquetWriter(str(path), RECORD_SCHEMA, compression="zstd") as writer:
+        rows = []
+        for record in records:
+            rows.append(_to_row(record))
+            if len(rows) >= row_group_size:
+                writer.write_batch(_rows_to_batch(rows))
+                count += len(rows)
+                rows = []
+        if rows:
+            writer.write_batch(_rows_to_batch(rows))
+            count += len(rows)
+    return count
+
+
+class PartitionWriter:
+    """
+    Streams records into numbered partition files of partition_size records
+    (starwars_all_canon_data_1.parquet, _2, ...), flushing a row group at a
+    time so only row_group_size records are ever held in memory.
+    """
+    def __init__(self, folder, partition_size: int = PARTITION_SIZE, row_group_size: int = ROW_GROUP_SIZE,
+                 start_number: int = 1, template: str = PARTITION_TEMPLATE):
+        self.folder = Path(folder)
+        self.partition_size = partition_size
+        self.row_group_size = row_group_size
+        self.number = start_number
+        self.template = template
+        self.paths = []
+
+        self._writer = None
+        self._rows = []
+        self._partition_count = 0
+
+    def add(self, record: dict):
+        if self._writer is None:
+            path = self.folder / self.template.format(self.number)
+            self._writer = pq.ParquetWriter(str(path), RECORD_SCHEMA, compression="zstd")
+            self.paths.append(path)
+
+        self._rows.append(_to_row(record))
+        self._partition_count += 1
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+        if self._partition_count >= self.partition_size:
+            self._close_partition()
+
+    def close(self):
+        if self._writer is not None:
+            self._close_partition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_batch(_rows_to_batch(self._rows))
+            self._rows = []
+
+    def _close_partition(self):
+        self._flush()
+        self._writer.close()
+        self._writer = None
+        self._partition_count = 0
+        self.number += 1
+
+
+def replace_partitions(folder, records, partition_size: int = PARTITION_SIZE) -> int:
+    """
+    Write records as a fresh set of partitions in folder. They are written
+    to a staging folder first and swapped in at the end, so an interrupted
+    run leaves the previous partitions alone. Returns the record count.
+    """
+    folder = Path(folder)
+    staging = folder / ".staging"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    count = 0
+    with PartitionWriter(staging, partition_size) as writer:
+        for record in records:
+            writer.add(record)
+            count += 1
+
+    for path in folder.glob(PARTITION_GLOB):
+        path.unlink()
+    for path in sorted(staging.iterdir()):
+        os.replace(path, folder / path.name)
+    staging.rmdir()
+    return count
+
+
+def merge_records(folder, updates: dict, removed: set = frozenset()) -> tuple:
+    """
+    Apply { id: record } to the Parquet partitions in folder: records whose
+    id is already in a partition are replaced in place (only partitions that
+    hold one are rewritten), the rest go to a new partition at the end.
+    Records whose id is in removed are dropped.
+    Returns (replaced, added, dropped).
+    """
+    remaining = dict(updates)
+    replaced = 0
+    dropped = 0
+    files = sorted(Path(folder).glob(PARTITION_GLOB))
+    for path in files:
+        ## the id column alone tells whether this partition needs a rewrite
+        ids = set(pq.read_table(str(path), columns=["id"]).column("id").to_pylist())
+        hits = ids & remaining.keys()
+        drops = ids & set(removed)
+        if not hits and not drops:
+            continue
+        tmp_path = path.with_name(path.name + ".tmp")
+        write_partition((remaining[r["id"]] if r["id"] in hits else r
+                         for r in iter_records([path]) if r["id"] not in drops), tmp_path)
+        os.replace(tmp_path, path)
+        for record_id in hits:
+            del remaining[record_id]
+        replaced += len(hits)
+        dropped += len(drops)
+
+    if remaining:
+        numbers = [int(p.stem.rsplit("_", 1)[-1]) for p in files]
+        write_partition(remaining.values(), Path(folder) / PARTITION_TEMPLATE.format(max(numbers, default=0) + 1))
+    return replaced, len(remaining), dropped
+
+
+def partition_files(folder, pattern: str = PARTITION_GLOB) -> list:
+    """
+    Sorted partition files in folder. Falls back to the legacy pickle
+    partitions when no Parquet partitions exist yet.
+    """
+    files = sorted(Path(folder).glob(pattern))
+    if not files and pattern == PARTITION_GLOB:
+        files = sorted(Path(folder).glob(LEGACY_PARTITION_GLOB))
+    return files
+
+
+def iter_record_batches(paths, columns: list = None, batch_size: int = ROW_GROUP_SIZE):
+    """
+    Stream pyarrow RecordBatches from memory-mapped Parquet files, reading
+    only the requested columns.
+    """
+    for path in paths:
+        parquet_file = pq.ParquetFile(str(path), memory_map=True)
+        yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def iter_records(paths, columns: list = None, batch_size: int = ROW_GROUP_SIZE):
+    """
+    Stream records (dicts in the load_data.py schema) from partition files,
+    optionally projected to some columns. Legacy .pickle partitions are
+    still readable, but have to be loaded whole.
+    """
+    for path in paths:
+        if Path(path).suffix == ".pickle":
+            with open(path, 'rb') as f:
+                part = pickle.load(f)
+            for record in part.values():
+                yield {k: v for k, v in record.items() if columns is None or k in columns}
+            continue
+
+        for batch in iter_record_batches([path], columns, batch_size):
+            for row in batch.to_pylist():
+                yield _from_row(row)
+
+
+def read_records_by_id(paths, columns: list = None) -> dict:
+    """
+    Load small record files (e.g. a repair set) into { id: record }.
+    """
+    return {record["id"]: record for record in iter_records(paths, columns)}
@@ -0,0 +1,103 @@
+import sqlite3
+
+import orjson
+
+DOCSTORE_PATH = './Dataset/starwars_docs.sqlite'
+BATCH_SIZE = 1000  # records per transaction / per page of an iteration
+
+
+class DocStore:
+    """
+    Scraped records in one SQLite file, keyed by page id, so single pages
+    can be looked up, repaired or replaced without rewriting partitions.
+
+    The docs table is a clustered B-tree on id (WITHOUT ROWID): a get is one
+    index probe and iteration comes out in key order. Records are stored as
+    orjson-encoded blobs. WAL mode lets readers run while a writer upserts.
+    """
+    def __init__(self, path: str = DOCSTORE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, record BLOB NOT NULL) WITHOUT ROWID")
+
+    def get(self, doc_id: str) -> dict:
+        row = self.conn.execute("SELECT record FROM docs WHERE id = ?", (doc_id,)).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def get_many(self, doc_ids: list) -> dict:
+        """
+        { id: record } for the ids that are stored.
+        """
+        found = {}
+        doc_ids = list(doc_ids)
+        ## stay under SQLite's bound parameter limit
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for doc_id, record in self.conn.execute(f"SELECT id, record FROM docs WHERE id IN ({placeholders})", batch):
+                found[doc_id] = orjson.loads(record)
+        return found
+
+    def upsert_many(self, records, batch_size: int = BATCH_SIZE) -> int:
+        """
+        Insert or replace records (by their 'id'), one transaction per batch.
+        Accepts any iterable, so partitions can be streamed in. Returns the count.
+        """
+        count = 0
+        batch = []
+        for record in records:
+            batch.append((record["id"], orjson.dumps(record)))
+            if len(batch) >= batch_size:
+                count += self._write(batch)
+                batch = []
+        if batch:
+            count += self._write(batch)
+        return count
+
+    def delete_many(self, doc_ids: list) -> int:
+        with self.conn:
+            cursor = self.conn.executemany("DELETE FROM docs WHERE id = ?", ((doc_id,) for doc_id in doc_ids))
+        return cursor.rowcount
+
+    def iter_records(self, batch_size: int = BATCH_SIZE):
+        """
+        Stream every record in key order. Reads one page at a time by key,
+        so no cursor is held open between pages and writes can interleave.
+        """
+        last_id = ""
+        while True:
+            rows = self.conn.execute("SELECT id, record FROM docs WHERE id > ? ORDER BY id LIMIT ?",
+                                     (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for doc_id, record in rows:
+                yield orjson.loads(record)
+            last_id = rows[-1][0]
+
+    def ids(self) -> list:
+        return [row[0] for row in self.conn.execute("SELECT id FROM docs ORDER BY id")]
+
+    def __contains__(self, doc_id: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM docs WHERE id = ?", (doc_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, batch: list) -> int:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO docs (id, record) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET record = excluded.record",
+                batch
+            )
+        return len(batch)
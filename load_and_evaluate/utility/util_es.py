@@ -1,6 +1,14 @@
 from elasticsearch import Elasticsearch, helpers, OrjsonSerializer
 from elasticsearch import BadRequestError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import os
+import time
+import hashlib
+import orjson
+from tqdm import tqdm
+
+from utility.util_retrieval_cache import get_retrieval_cache, has_inner_hits
+from utility.util_cache_store import content_hash as text_hash
 
 es_host = os.getenv("ES_SERVER")
 es_api_key = os.getenv("ES_API_KEY")
@@ -24,6 +32,16 @@ def get_es() -> Elasticsearch:
     return es
 
 
+## Hits fetched per ranking search when the caller doesn't say otherwise (the
+## Elasticsearch default). search_to_context only asks for the hits it uses.
+DEFAULT_SEARCH_SIZE = 10
+
+## search_to_context in "passages" mode, for query bodies without inner_hits:
+## highlight fragments of the context field stand in for the whole field
+PASSAGE_FRAGMENT_SIZE = 600   # characters per fragment
+PASSAGE_FRAGMENTS = 2         # fragments per hit
+
+
 def batchify(docs, batch_size):
     for i in range(0, len(docs), batch_size):
         yield docs[i:i + batch_size]
@@ -36,9 +54,7 @@ def bulkLoadIndex( es, json_docs, index_name, id_param, batch_size=10):
     if not es.indices.exists(index=index_name):
         raise BadRequestError(f"Index [{index_name}] needs to exist before bulk loading")
 
-    batches = list(batchify(json_docs, batch_size))
-
-    for batch in batches:
+    for batch in batchify(json_docs, batch_size):
         # Convert the JSON documents to the format required for bulk insertion
         bulk_docs = [
             {
@@ -58,14 +74,286 @@ def bulkLoadIndex( es, json_docs, index_name, id_param, batch_size=10):
 
 
 
-def search_to_context(es: Elasticsearch, index_name: str, body: dict, rag_context: str, trim_context_len: int) -> list:
-    results = es.search(index=index_name, body=body)
+def docs_to_actions(docs, index_name: str, id_param: str):
+    """
+    Lazily turn documents into bulk "index" actions.
+    """
+    for doc in docs:
+        yield {
+            "_op_type": "index",
+            "_index": index_name,
+            "_source": doc,
+            "_id": doc[id_param]
+        }
+
+
+## keyword fields used for delta loads: a hash of the rest of the document, and a
+## hash of just the fields semantic_text inference reads (see delta_actions)
+CONTENT_HASH_FIELD = "content_hash"
+INFERENCE_HASH_FIELD = "inference_hash"
+
+
+def content_hash(doc: dict, fields: list = None) -> str:
+    """
+    Stable hash of the given fields of a document, by default every field
+    except the hash fields themselves.
+    """
+    if fields is None:
+        fields = [k for k in doc if k not in (CONTENT_HASH_FIELD, INFERENCE_HASH_FIELD)]
+    return hashlib.sha256(orjson.dumps({k: doc.get(k) for k in fields}, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def fetch_content_hashes(es, index_name: str) -> dict:
+    """
+    Return { doc_id: { content_hash, inference_hash } } for every document
+    in index_name, reading only the hash fields (None for documents loaded
+    without them).
+    """
+    if not es.indices.exists(index=index_name):
+        return {}
+
+    hashes = {}
+    for hit in helpers.scan(es, index=index_name, query={"query": {"match_all": {}}},
+                            _source=[CONTENT_HASH_FIELD, INFERENCE_HASH_FIELD], size=5000):
+        source = hit.get("_source", {})
+        hashes[hit["_id"]] = {field: source.get(field) for field in (CONTENT_HASH_FIELD, INFERENCE_HASH_FIELD)}
+    return hashes
+
+
+def delta_actions(docs, index_name: str, id_param: str, existing_hashes: dict, stats: dict, delete_missing: bool = True,
+                  inference_fields: list = None):
+    """
+    Compare a stream of documents against the hashes already in the index and
+    yield bulk actions only for what changed:
+      - "index" for new documents and documents whose content hash differs
+      - "update" instead, without the inference_fields, when those are
+        unchanged (their inference hash matches): a partial update that
+        leaves the semantic_text inputs alone doesn't run inference again
+      - "delete" for indexed documents no longer in the stream (if delete_missing)
+
+    inference_fields are the fields semantic_text inference reads (the
+    copy_to sources of the index's semantic_text fields); leave it unset
+    for indices without inference. Unchanged documents are skipped, so
+    inference only runs on the changed ones. Counts go into stats:
+    created/updated/deleted/unchanged, and reused_inference for the
+    updates that kept their embeddings.
+    """
+    for key in ["created", "updated", "deleted", "unchanged", "reused_inference"]:
+        stats.setdefault(key, 0)
+
+    seen = set()
+    for doc in docs:
+        doc_id = doc[id_param]
+        seen.add(doc_id)
+        hashes = {CONTENT_HASH_FIELD: content_hash(doc)}
+        if inference_fields:
+            hashes[INFERENCE_HASH_FIELD] = content_hash(doc, inference_fields)
+        existing = existing_hashes.get(doc_id)
+
+        if existing is None:
+            stats["created"] += 1
+        elif existing[CONTENT_HASH_FIELD] != hashes[CONTENT_HASH_FIELD]:
+            stats["updated"] += 1
+        else:
+            stats["unchanged"] += 1
+            continue
+
+        if inference_fields and existing is not None and existing[INFERENCE_HASH_FIELD] == hashes[INFERENCE_HASH_FIELD]:
+            stats["reused_inference"] += 1
+            yield {
+                "_op_type": "update",
+                "_index": index_name,
+                "_id": doc_id,
+                "doc": {**{k: v for k, v in doc.items() if k not in inference_fields}, **hashes}
+            }
+            continue
+
+        yield {
+            "_op_type": "index",
+            "_index": index_name,
+            "_source": {**doc, **hashes},
+            "_id": doc_id
+        }
+
+    if delete_missing:
+        for doc_id in existing_hashes.keys() - seen:
+            stats["deleted"] += 1
+            yield {
+                "_op_type": "delete",
+                "_index": index_name,
+                "_id": doc_id
+            }
+
+
+def chunk_actions(actions, chunk_size: int, max_chunk_bytes: int):
+    """
+    Group a stream of bulk actions into lists of at most chunk_size actions
+    and (roughly) max_chunk_bytes of serialized request body.
+    """
+    chunk = []
+    chunk_bytes = 0
+    for action in actions:
+        ## action metadata line + source line, like the bulk body itself
+        action_bytes = len(orjson.dumps(action.get("_source", action.get("doc", {})))) + 100
+        if chunk and (len(chunk) >= chunk_size or chunk_bytes + action_bytes > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(action)
+        chunk_bytes += action_bytes
+    if chunk:
+        yield chunk
+
+
+def parallelBulkLoad(es, actions, chunk_size=500, max_chunk_bytes=10 * 1024 * 1024,
+                     max_in_flight=4, max_retries=5, initial_backoff=2, max_backoff=60) -> int:
+    """
+    Stream bulk actions to Elasticsearch with up to max_in_flight bulk
+    requests running at once. Requests are cut by doc count and by bytes,
+    and 429 rejections (whole requests or single items) are retried with
+    exponential backoff. Reports throughput in docs/s.
+
+    helpers.parallel_bulk has no retry support, so each chunk goes through
+    helpers.bulk (streaming_bulk's 429 handling) on a bounded thread pool.
+
+    Returns the number of successfully indexed actions.
+    """
+    def send(chunk):
+        success, errors = helpers.bulk(
+            es, chunk,
+            chunk_size=len(chunk),
+            max_chunk_bytes=max_chunk_bytes * 2,  # already sized by chunk_actions
+            max_retries=max_retries,
+            initial_backoff=initial_backoff,
+            max_backoff=max_backoff,
+            raise_on_error=False
+        )
+        for error in errors:
+            print(error)
+        return len(chunk), success
+
+    total_sent = 0
+    total_success = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor, tqdm(unit="docs") as progress:
+        in_flight = set()
+        for chunk in chunk_actions(actions, chunk_size, max_chunk_bytes):
+            ## keep at most max_in_flight requests queued behind the running ones,
+            ## so the reader never gets far ahead of the cluster
+            if len(in_flight) >= max_in_flight * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sent, success = future.result()
+                    total_sent += sent
+                    total_success += success
+                    progress.update(sent)
+            in_flight.add(executor.submit(send, chunk))
+
+        for future in in_flight:
+            sent, success = future.result()
+            total_sent += sent
+            total_success += success
+            progress.update(sent)
+
+    elapsed = time.perf_counter() - start
+    print(f"Bulk loaded {total_success}/{total_sent} docs in {elapsed:.1f}s ({total_sent / max(elapsed, 1e-9):.0f} docs/s)")
+    return total_success
+
+
+class ContextPassage(str):
+    """
+    A retrieved passage: the text handed to the LLM, carrying the id of the
+    document it came from, the hit's score and a hash of the text, so the
+    RAG cache can key on them instead of the text itself.
+    """
+    def __new__(cls, text: str, doc_id: str = None, digest: str = None, score: float = None):
+        passage = super().__new__(cls, text)
+        passage.doc_id = doc_id
+        passage.content_hash = digest or text_hash(text)
+        passage.score = score
+        return passage
+
+
+def search_to_context(es: Elasticsearch, index_name: str, body: dict, rag_context: str, trim_context_len: int,
+                      mode: str = "document") -> list:
+    """
+    Context for the RAG prompt from the top trim_context_len hits, as ContextPassages.
+      mode "document": the whole rag_context field of every hit
+      mode "passages": only the parts of it that matched the query: the
+        chunks the body's inner_hits return (semantic_text strategies), or
+        highlight fragments of rag_context for bodies without inner_hits.
+        Hits that come back with neither get their whole field.
+    """
+    if mode == "passages":
+        try:
+            return passages_to_context(es, index_name, body, rag_context, trim_context_len)
+        except BadRequestError as e:
+            print(f"Passage context not supported by this query on {index_name}, using whole documents: {e}")
+
+    hits = get_retrieval_cache().search(es, index_name, body, trim_context_len, [rag_context])
 
     context = []
-    # results['hits']['hits'] is the list of hits returned by Elasticsearch
-    for hit in results['hits']['hits'][:trim_context_len]:
+    for hit in hits[:trim_context_len]:
         # Safely get the value in case `rag_context` is missing
         context_value = hit["_source"].get(rag_context, "")
-        context.append(str(context_value))
+        context.append(ContextPassage(str(context_value), f"{index_name}/{hit['_id']}", score=hit["_score"]))
+
+    return context
+
+
+def passage_highlight(body: dict, rag_context: str):
+    """
+    The highlight passages_to_context asks for: plain text fragments of
+    rag_context, or None when the body's inner_hits supply the passages.
+    """
+    if has_inner_hits(body):
+        return None
+    return {
+        "pre_tags": [""], "post_tags": [""],  # plain text for the prompt
+        "fields": {rag_context: {
+            "type": "unified",
+            "fragment_size": PASSAGE_FRAGMENT_SIZE,
+            "number_of_fragments": PASSAGE_FRAGMENTS,
+            "order": "score",
+            "no_match_size": PASSAGE_FRAGMENT_SIZE,
+        }},
+    }
+
+
+def passages_to_context(es: Elasticsearch, index_name: str, body: dict, rag_context: str, trim_context_len: int) -> list:
+    hits = get_retrieval_cache().search_passages(es, index_name, body, trim_context_len, passage_highlight(body, rag_context))
+
+    missing = [hit["_id"] for hit in hits if not hit["passages"]]
+    sources = get_retrieval_cache().get_sources(es, index_name, missing, [rag_context]) if missing else {}
+
+    context = []
+    for hit in hits:
+        doc_id = f"{index_name}/{hit['_id']}"
+        texts = hit["passages"] or [str(sources.get(hit["_id"], {}).get(rag_context, ""))]
+        context.extend(ContextPassage(text, doc_id, score=hit["_score"]) for text in texts)
+    return context
+
+
+def warm_search_to_context(es: Elasticsearch, index_name: str, bodies: list, rag_context: str, size: int,
+                           mode: str = "document"):
+    """
+    Prefetch what search_to_context will ask the retrieval cache for, for
+    many bodies in a single _msearch: the passages (mode "passages") or the
+    rankings (mode "document", whose _source then comes by id). size should
+    be at least the trim_context_len of the later calls.
+    """
+    cache = get_retrieval_cache()
+    if mode == "passages":
+        cache.msearch_passages(es, index_name, bodies, size, lambda body: passage_highlight(body, rag_context))
+    else:
+        cache.msearch(es, index_name, bodies, size)
+
 
-    return context
\ No newline at end of file
+def msearch_ranked_ids(es: Elasticsearch, index_name: str, bodies: list, size: int = DEFAULT_SEARCH_SIZE) -> list:
+    """
+    Run every query body against index_name in a single _msearch request and
+    return the ranked hit ids for each one, in the same order as `bodies`.
+    Searches that fail come back as None. Rankings already in the retrieval
+    cache are not sent again.
+    """
+    return get_retrieval_cache().msearch(es, index_name, bodies, size)
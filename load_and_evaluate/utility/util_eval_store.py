@@ -0,0 +1,81 @@
+import json
+import os
+import hashlib
+
+STORE_FILE_PATH = "evaluation_store.json"
+STORE_VERSION = 1  # bump to invalidate every stored result
+
+
+class EvalResultStore:
+    """
+    Persisted evaluation results, keyed by a hash of everything that can
+    change them:
+       phase || strategy (and helper) source || golden row || index name || parameters
+
+    evaluate.py only recomputes the strategy/query pairs whose key is not
+    stored yet and merges the rest from here. Loaded once at startup and
+    written back (atomically) with save().
+    """
+    def __init__(self, store_file_path: str = STORE_FILE_PATH):
+        self.store_file_path = store_file_path
+        self.results = {}  # key -> stored result
+        self._file_hashes = {}
+
+        self._load_from_disk()
+
+    def make_key(self, phase: str, source_files: list, golden_row: dict, index_name: str, parameters: dict) -> str:
+        """
+        Create a repeatable hash for one strategy/query pair of a phase.
+        source_files are hashed by content, so editing a strategy (or a
+        helper it depends on) invalidates only that strategy's results.
+        """
+        raw = json.dumps({
+            "version": STORE_VERSION,
+            "phase": phase,
+            "sources": [self._hash_file(path) for path in source_files],
+            "golden_row": golden_row,
+            "index_name": index_name,
+            "parameters": parameters,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        return self.results.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.results
+
+    def put(self, key: str, result):
+        self.results[key] = result
+
+    def _hash_file(self, path: str) -> str:
+        path = os.path.abspath(path)
+        if path not in self._file_hashes:
+            with open(path, "rb") as f:
+                self._file_hashes[path] = hashlib.sha256(f.read()).hexdigest()
+        return self._file_hashes[path]
+
+    def _load_from_disk(self):
+        """
+        Load stored results from disk (JSON) if they exist.
+        """
+        if os.path.isfile(self.store_file_path):
+            try:
+                with open(self.store_file_path, "r", encoding="utf-8") as f:
+                    self.results = json.load(f)
+            except Exception as e:
+                print(f"[EvalResultStore] Warning: Could not load results from disk: {e}")
+                self.results = {}
+
+    def save(self):
+        """
+        Write all results to disk, replacing the previous file in one step
+        so an interrupted run never leaves a truncated store behind.
+        """
+        tmp_path = f"{self.store_file_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.results, f, ensure_ascii=False)
+            os.replace(tmp_path, self.store_file_path)
+        except Exception as e:
+            print(f"[EvalResultStore] Error: Could not persist results to disk: {e}")
@@ -1,72 +1,324 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import weakref
+from functools import lru_cache
 
+import httpx
 import openai
 
 from utility.util_llm_rag_cache import LLMRagCache
+from utility.util_rate_limit import TokenBucket
+
+## System prompt of the RAG strategies. {context} is filled with the retrieved
+## passages only when the answer isn't cached; the cache keys on a hash of
+## this template, so editing it starts a fresh set of answers.
+RAG_PROMPT_TEMPLATE = """
+Instructions:
+  
+  - You are an assistant for question-answering tasks.
+  - Answer questions truthfully and factually using only the context presented.
+  - If you don't know the answer, just say that you don't know, don't make up an answer.
+  - You are correct, factual, precise, and reliable.
+
+
+  Context:
+  {context}
+"""
+
+RAG_MODEL = "gpt-4o"               # model of the RAG answers when a strategy doesn't pick one
+LLM_REQUESTS_PER_MINUTE = 500      # client side budgets, keep them a little under the account's limits
+LLM_TOKENS_PER_MINUTE = 300000
+LLM_BURST_SECONDS = 10             # how much of a minute's budget may go out at once
+LLM_COMPLETION_TOKENS = 512        # tokens reserved for the answer when estimating a request's cost
+LLM_MAX_RETRIES = 6
+LLM_BASE_BACKOFF = 1.0             # seconds, doubled per attempt (full jitter)
+LLM_MAX_BACKOFF = 60.0
+LLM_TIMEOUT = 120.0
+LLM_MAX_CONNECTIONS = 64           # pooled keep-alive connections per client
+TRANSFORM_TOKENS_PER_ITEM = 64     # answer tokens reserved per question of a batched transform
+
+## Appended to a query transform prompt when many questions are rewritten in one request
+BATCH_TRANSFORM_INSTRUCTIONS = """
+
+You will receive a JSON array of questions, each with an id. Apply the instructions above to every
+question on its own, as if it were the only one, and return one rewrite per id."""
+
+## Structured output of a batched transform: [{ id, rewrite }]
+BATCH_TRANSFORM_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "rewrites",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "rewrites": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "integer"}, "rewrite": {"type": "string"}},
+                        "required": ["id", "rewrite"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["rewrites"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+## Worth another try: 429, 5xx, timeouts and dropped connections
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APITimeoutError, openai.APIConnectionError)
+
+
+class LLMError(Exception):
+    """
+    An LLM call that failed for good: a non retryable error, or a retryable
+    one that outlasted LLM_MAX_RETRIES. Never cached, so the next run retries.
+    """
 
 
 class LLMUtil:
-    def __init__(self, openai_api_key: str):
+    """
+    Chat completions through one pooled OpenAI client per process (and one
+    async client per event loop), shared by every caller.
+
+    Each request first takes from two token buckets, one for requests and
+    one for (estimated) tokens per minute, so concurrent callers stay under
+    the quota instead of tripping 429s. 429s, 5xx and network errors are
+    retried with exponential backoff, honoring Retry-After. Anything else,
+    or running out of retries, raises LLMError.
+    """
+    def __init__(self, openai_api_key: str, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE):
         # Set your OpenAI API key
         openai.api_key = openai_api_key
+        self.openai_api_key = openai_api_key
         self.cache_helper = LLMRagCache()
 
+        self.request_bucket = TokenBucket(requests_per_minute / 60, requests_per_minute * LLM_BURST_SECONDS / 60)
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute * LLM_BURST_SECONDS / 60)
+        ## created on first use, so a missing API key only matters once an LLM call is made
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+
     def transform_query(self, system_prompt: str, user_query: str, model_name: str = "gpt-4o") -> str:
         """
         Calls OpenAI ChatGPT (e.g., GPT-4) to transform the user_query
         using the system_prompt as context. Returns the model's text response.
         """
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user",   "content": user_query}
-        ]
+        return self.complete(model_name, self._messages(system_prompt, user_query))
+
+    async def transform_query_async(self, system_prompt: str, user_query: str, model_name: str = "gpt-4o") -> str:
+        return await self.complete_async(model_name, self._messages(system_prompt, user_query))
 
+    def transform_queries(self, system_prompt: str, user_queries: list, model_name: str = "gpt-4o") -> list:
+        """
+        Transform many questions with the same system_prompt in one
+        structured output request. Returns one rewrite per question, None
+        for questions the response has no usable rewrite for (the caller
+        falls back to transform_query for those). Raises LLMError when the
+        request itself fails.
+        """
+        messages = self._messages(
+            system_prompt + BATCH_TRANSFORM_INSTRUCTIONS,
+            json.dumps([{"id": ix, "question": query} for ix, query in enumerate(user_queries)], ensure_ascii=False)
+        )
+        content = self.complete(model_name, messages, response_format=BATCH_TRANSFORM_FORMAT,
+                                completion_tokens=TRANSFORM_TOKENS_PER_ITEM * len(user_queries))
+        rewrites = [None] * len(user_queries)
         try:
-            completion = openai.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                temperature=0.0  # or any other temperature you prefer
-            )
+            items = json.loads(content)["rewrites"]
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[LLMUtil] Unparseable batch transform from {model_name}: {e}")
+            return rewrites
+        for item in items:
+            try:
+                ix, rewrite = int(item["id"]), item["rewrite"].strip()
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+            if 0 <= ix < len(rewrites) and rewrite:
+                rewrites[ix] = rewrite
+        return rewrites
+
+    def rag_cache(self,
+                  prompt_template: str,
+                  retrieval_context: list,
+                  query_string: str,
+                  model_name: str = RAG_MODEL) -> str:
 
-            # Extract the content of the first (and typically only) completion
-            transformed_query = completion.choices[0].message.content.strip()
-            return transformed_query
-        
-        except Exception as e: 
-            print(f"General exception encountered: {e}")
-            # Decide how you want to handle the error; return original query or raise exception
-            return user_query
+        return self.cache_helper.rag(prompt_template, retrieval_context, query_string, model_name, self)
 
-    def rag_cache(self, 
-                  system_prompt: str, 
-                  retrieval_context: list, 
-                  query_string: str, 
-                  model_name: str = "gpt-4o") -> str:
-        
-        return self.cache_helper.rag(system_prompt, retrieval_context, query_string, model_name, self)
+    async def rag_cache_async(self,
+                              prompt_template: str,
+                              retrieval_context: list,
+                              query_string: str,
+                              model_name: str = RAG_MODEL) -> str:
 
+        return await self.cache_helper.rag_async(prompt_template, retrieval_context, query_string, model_name, self)
 
     def rag(self, system_prompt: str, retrieval_context: list, query_string: str, model_name: str = "gpt-4o") -> str:
-        messages = [
+        rag_answer = self.complete(model_name, self._messages(system_prompt, query_string))
+
+        print(f"question: {query_string}")
+        print(f"\t{rag_answer}")
+
+        return rag_answer
+
+    async def rag_async(self, system_prompt: str, retrieval_context: list, query_string: str,
+                        model_name: str = "gpt-4o") -> str:
+        rag_answer = await self.complete_async(model_name, self._messages(system_prompt, query_string))
+
+        print(f"question: {query_string}")
+        print(f"\t{rag_answer}")
+
+        return rag_answer
+
+    def complete(self, model_name: str, messages: list, completion_tokens: int = LLM_COMPLETION_TOKENS, **kwargs) -> str:
+        """
+        One chat completion, rate limited and retried. Returns the text of
+        the first choice; raises LLMError. completion_tokens is the answer
+        size assumed for the token budget.
+        """
+        cost = estimate_tokens(model_name, messages, completion_tokens)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            self.request_bucket.acquire()
+            self.token_bucket.acquire(cost)
+            try:
+                completion = self.client().chat.completions.create(
+                    model=model_name, messages=messages, temperature=0.0, **kwargs)
+                return self._content(model_name, completion)
+            except RETRYABLE_ERRORS as e:
+                time.sleep(self._retry_delay(model_name, attempt, e))
+            except openai.OpenAIError as e:
+                raise LLMError(f"{model_name}: {e}") from e
+
+    async def complete_async(self, model_name: str, messages: list, completion_tokens: int = LLM_COMPLETION_TOKENS,
+                             **kwargs) -> str:
+        """
+        complete() for coroutines, on the event loop's own async client.
+        """
+        cost = estimate_tokens(model_name, messages, completion_tokens)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self.request_bucket.acquire_async()
+            await self.token_bucket.acquire_async(cost)
+            try:
+                completion = await self.async_client().chat.completions.create(
+                    model=model_name, messages=messages, temperature=0.0, **kwargs)
+                return self._content(model_name, completion)
+            except RETRYABLE_ERRORS as e:
+                await asyncio.sleep(self._retry_delay(model_name, attempt, e))
+            except openai.OpenAIError as e:
+                raise LLMError(f"{model_name}: {e}") from e
+
+    def client(self) -> openai.OpenAI:
+        with self._client_lock:
+            if self._client is None:
+                ## retries are ours (they go through the rate limiter), so the SDK's are off
+                self._client = openai.OpenAI(
+                    api_key=self.openai_api_key, max_retries=0, timeout=LLM_TIMEOUT,
+                    http_client=openai.DefaultHttpxClient(limits=_pool_limits())
+                )
+            return self._client
+
+    def async_client(self) -> openai.AsyncOpenAI:
+        ## an async client's connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = openai.AsyncOpenAI(
+                api_key=self.openai_api_key, max_retries=0, timeout=LLM_TIMEOUT,
+                http_client=openai.DefaultAsyncHttpxClient(limits=_pool_limits())
+            )
+        return client
+
+    def _messages(self, system_prompt: str, user_content: str) -> list:
+        return [
             {"role": "system", "content": system_prompt},
-            {"role": "user",   "content": query_string}
+            {"role": "user",   "content": user_content}
         ]
 
-        try:
-            completion = openai.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                temperature=0.0  # or any other temperature you prefer
-            )
+    def _content(self, model_name: str, completion) -> str:
+        content = completion.choices[0].message.content if completion.choices else None
+        if content is None:
+            raise LLMError(f"{model_name}: empty completion (finish_reason="
+                           f"{completion.choices[0].finish_reason if completion.choices else None})")
+        return content.strip()
+
+    def _retry_delay(self, model_name: str, attempt: int, error: Exception) -> float:
+        """
+        Seconds to wait before retrying error, or LLMError when out of retries.
+        """
+        if attempt >= LLM_MAX_RETRIES:
+            raise LLMError(f"{model_name}: giving up after {attempt + 1} attempts: {error}") from error
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(LLM_MAX_BACKOFF, LLM_BASE_BACKOFF * 2 ** attempt))
+        delay = min(delay, LLM_MAX_BACKOFF)
+        print(f"[LLMUtil] {type(error).__name__} from {model_name}, retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+        return delay
+
+
+def retry_after(error: Exception) -> float:
+    """
+    The wait the server asked for (retry-after-ms / Retry-After headers), if any.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                continue  # an HTTP date, fall back to our own backoff
+    return None
+
+
+def estimate_tokens(model_name: str, messages: list, completion_tokens: int = LLM_COMPLETION_TOKENS) -> int:
+    """
+    Prompt tokens of messages plus the completion allowance, for the token bucket.
+    """
+    prompt = sum(count_tokens(message["content"], model_name) for message in messages)
+    return prompt + 4 * len(messages) + completion_tokens
 
-            # Extract the content of the first (and typically only) completion
-            rag_answer = completion.choices[0].message.content.strip()
 
-            print(f"question: {query_string}")
-            print(f"\t{rag_answer}")
+def count_tokens(text: str, model_name: str = "gpt-4o") -> int:
+    encoding = _encoding(model_name)
+    ## encode_ordinary skips the special token checks, plain text never has them
+    return len(encoding.encode_ordinary(text)) if encoding else len(text) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: str = "gpt-4o") -> str:
+    """
+    The longest prefix of text that is at most max_tokens tokens.
+    """
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode_ordinary(text)
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+@lru_cache(maxsize=None)
+def _encoding(model_name: str):
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        ## tiktoken missing or its vocabulary can't be downloaded: estimate by length
+        print(f"[LLMUtil] Warning: no tokenizer for {model_name} ({e}), estimating tokens from length")
+        return None
+
 
-            return rag_answer
-        
-        except Exception as e: 
-            print(f"General exception encountered: {e}")
-            # Decide how you want to handle the error; return original query or raise exception
-            return "Unable to return response due to an LLM error"
\ No newline at end of file
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
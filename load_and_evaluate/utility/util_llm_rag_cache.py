@@ -1,127 +1,146 @@
-import json
-import os
-import atexit
 import hashlib
-from collections import OrderedDict
+from functools import lru_cache
 
-CACHE_FILE_PATH = "rag_cache.json"
-MAX_CACHE_SIZE = 1000  # Adjust to your desired capacity
+from utility.util_cache import make_cache
+from utility.util_cache_store import CACHE_DB_PATH, BlobStore, content_hash
 
 
 class LLMRagCache:
     """
-    A simple LRU cache for storing responses from rag(...) calls.
+    A cache for storing responses from rag(...) calls.
     Cache key is derived from:
-       system_prompt || retrieval_context || query_string || model_name
-
-    Persists and loads its state from disk as JSON.
+       prompt template id || passage ids || query_string || model_name
+
+    The template id is a hash of the prompt template, and each passage is
+    identified by its document id and content hash (see
+    util_es.ContextPassage), so a lookup never builds or hashes the full
+    prompt. The passage texts are stored once each in a content-addressed
+    BlobStore and cache entries only refer to them by hash. Concurrent
+    misses on the same key share one LLM call.
+
+    Entries live in the "rag" namespace of the tiered cache (memory, then
+    the shared SQLite database), with the budgets and TTL set in
+    util_cache.CACHE_CONFIG.
     """
-    def __init__(self, cache_file_path: str = CACHE_FILE_PATH, max_size: int = MAX_CACHE_SIZE):
+    def __init__(self, cache_file_path: str = CACHE_DB_PATH):
         self.cache_file_path = cache_file_path
-        self.max_size = max_size
-        # key -> { 'system_prompt', 'retrieval_context', 'query_string', 'model_name', 'answer' }
-        self.cache = OrderedDict()
-        
-        # Load cache from disk on startup
-        self._load_from_disk()
-
-        # Register exit handler to persist cache on program exit
-        atexit.register(self._persist_to_disk)
-
-    def rag(self, system_prompt: str, retrieval_context: list, query_string: str, 
+        # key -> { 'answer', 'template', 'context': [content hash], 'doc_ids', 'query', 'model' }
+        ## no rag_cache.json import: its keys hash the whole prompt, which these keys never match
+        self.cache = make_cache("rag", cache_file_path)
+        self.blobs = BlobStore("rag_context", cache_file_path)
+        ## passage texts go when the last answer using them is evicted
+        self.cache.tiers[-1].on_evict = lambda evicted: self.blobs.collect(self.cache.namespace)
+
+    def rag(self, prompt_template: str, retrieval_context: list, query_string: str,
             model_name: str, llm_util) -> str:
         """
-        Return a cached response if available; otherwise call llm_util.rag(...),
-        cache the result, and return it.
+        Return a cached response if available; otherwise fill prompt_template's
+        {context} with the passages, call llm_util.rag(...), cache the result,
+        and return it.
         """
-        cache_key = self._make_key(system_prompt, retrieval_context, query_string, model_name)
-
-        # LRU Cache Check
-        if cache_key in self.cache:
-            # Move to end (most recently used)
-            self.cache.move_to_end(cache_key, last=True)
-            return self.cache[cache_key]["answer"]
-        else:
+        passages = [passage_id(passage) for passage in retrieval_context]
+        cache_key = self._make_key(template_id(prompt_template), passages, query_string, model_name)
+
+        def load():
             # Generate a new answer via the LLM utility
             answer = llm_util.rag(
-                system_prompt=system_prompt, 
-                retrieval_context=retrieval_context, 
-                query_string=query_string, 
+                system_prompt=prompt_template.format(context="\n\n".join(retrieval_context)),
+                retrieval_context=retrieval_context,
+                query_string=query_string,
                 model_name=model_name
             )
+            return self._entry(prompt_template, retrieval_context, passages, query_string, model_name, answer)
 
-            # Insert into cache
-            self.cache[cache_key] = {
-                # "system_prompt": system_prompt,
-                # "retrieval_context": retrieval_context,
-                # "query_string": query_string,
-                # "model_name": model_name,
-                "answer": answer
-            }
-            self.cache.move_to_end(cache_key, last=True)
+        return self.cache.get_or_load(cache_key, load)["answer"]
 
-            # Enforce max size (LRU eviction)
-            if len(self.cache) > self.max_size:
-                self.cache.popitem(last=False)  # pop the least recently used item
+    async def rag_async(self, prompt_template: str, retrieval_context: list, query_string: str,
+                        model_name: str, llm_util) -> str:
+        """
+        rag for asyncio callers, through llm_util.rag_async.
+        """
+        passages = [passage_id(passage) for passage in retrieval_context]
+        cache_key = self._make_key(template_id(prompt_template), passages, query_string, model_name)
+
+        async def load():
+            answer = await llm_util.rag_async(
+                system_prompt=prompt_template.format(context="\n\n".join(retrieval_context)),
+                retrieval_context=retrieval_context,
+                query_string=query_string,
+                model_name=model_name
+            )
+            return self._entry(prompt_template, retrieval_context, passages, query_string, model_name, answer)
 
-            return answer
+        entry = await self.cache.get_or_load_async(cache_key, load)
+        return entry["answer"]
 
-    def _make_key(self, system_prompt: str, retrieval_context: list, 
-                  query_string: str, model_name: str) -> str:
+    def _entry(self, prompt_template: str, retrieval_context: list, passages: list,
+               query_string: str, model_name: str, answer: str) -> dict:
         """
-        Create a repeatable hash from the provided parameters.
+        The cache entry for a new answer, with the passage texts kept once
+        in the blob store.
         """
-        # Convert retrieval_context to a JSON string (deterministic ordering)
-        rc_json = json.dumps(retrieval_context, sort_keys=True)
-        raw_text = f"{system_prompt}||{rc_json}||{query_string}||{model_name}"
-        return hashlib.sha256(raw_text.encode("utf-8")).hexdigest()
-
-    def _load_from_disk(self):
+        for passage, (_, digest) in zip(retrieval_context, passages):
+            self.blobs.put(str(passage), digest)
+        return {
+            "answer": answer,
+            "template": template_id(prompt_template),
+            "context": [digest for _, digest in passages],
+            "doc_ids": [doc_id for doc_id, _ in passages],
+            "query": query_string,
+            "model": model_name,
+        }
+
+    def stored_context(self, entry: dict) -> list:
         """
-        Load the cache state from disk (JSON) if it exists.
+        The passage texts a cache entry was generated from.
         """
-        if os.path.isfile(self.cache_file_path):
-            try:
-                with open(self.cache_file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                # Convert the loaded dictionary into an OrderedDict
-                self.cache = OrderedDict(data)
-            except Exception as e:
-                print(f"[LLMRagCache] Warning: Could not load cache from disk: {e}")
-                self.cache = OrderedDict()
-        else:
-            # No cache file yet
-            self.cache = OrderedDict()
-
-    def _persist_to_disk(self):
+        return [self.blobs.get(digest) for digest in entry.get("context", [])]
+
+    def _make_key(self, template: str, passages: list, query_string: str, model_name: str) -> str:
         """
-        Write the current cache state to disk in JSON format.
-        Called automatically on interpreter exit (via `atexit`).
+        Create a repeatable hash from the provided parameters.
         """
-        try:
-            # Convert our OrderedDict to a regular dict for JSON dumping
-            data_to_save = dict(self.cache)
-            with open(self.cache_file_path, "w", encoding="utf-8") as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[LLMRagCache] Error: Could not persist cache to disk: {e}")
+        passage_keys = ",".join(f"{doc_id}@{digest}" for doc_id, digest in passages)
+        raw_text = f"{template}||{passage_keys}||{query_string}||{model_name}"
+        return hashlib.sha256(raw_text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=64)
+def template_id(prompt_template: str) -> str:
+    return content_hash(prompt_template)[:16]
+
+
+def answer_version(prompt_template: str, model_name: str) -> str:
+    """
+    What an answer depends on besides the query and its passages, for
+    caches that don't key on the prompt itself (util_semantic_cache).
+    """
+    return f"{template_id(prompt_template)}@{model_name}"
+
+
+def passage_id(passage: str) -> tuple:
+    """
+    (document id, content hash) of a retrieved passage. Plain strings have
+    no document id and are hashed here.
+    """
+    digest = getattr(passage, "content_hash", None) or content_hash(passage)
+    return getattr(passage, "doc_id", None) or "", digest
 
 
 # ----- Optional: Provide a module-level instance & convenience function -----
 
 # rag_cache = LLMRagCache()
 
-# def rag(system_prompt: str, retrieval_context: list, query_string: str, 
+# def rag(prompt_template: str, retrieval_context: list, query_string: str,
 #         model_name: str = "gpt-4", llm_util=None) -> str:
 #     """
 #     Convenience function that uses the module-level 'rag_cache' instance.
 #     """
-#     return rag_cache.rag(system_prompt, retrieval_context, query_string, model_name, llm_util)
+#     return rag_cache.rag(prompt_template, retrieval_context, query_string, model_name, llm_util)
 
 
 # def close_cache():
 #     """
-#     If you want to manually persist the cache instead of relying on atexit,
-#     you can call this function to persist right away.
+#     Close this thread's connection to the cache database.
 #     """
-#     rag_cache._persist_to_disk()
+#     rag_cache.cache.tiers[-1].close()
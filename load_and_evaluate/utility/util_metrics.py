@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def relevance_matrix(ranked_ids: list, best_ids: list, depth: int) -> np.ndarray:
+    """
+    Build a (queries x depth) 0/1 matrix where cell [q, r] is 1 when the
+    document at rank r for query q is one of that query's best_ids.
+
+    Missing rankings (None, e.g. a failed search) become all-zero rows.
+    """
+    rel = np.zeros((len(ranked_ids), depth), dtype=np.float64)
+    for q, (ids, relevant) in enumerate(zip(ranked_ids, best_ids)):
+        if not ids:
+            continue
+        relevant = set(relevant)
+        rel[q, :min(len(ids), depth)] = [doc_id in relevant for doc_id in ids[:depth]]
+    return rel
+
+
+def score_rankings(rel: np.ndarray, n_relevant: np.ndarray, ks: list) -> dict:
+    """
+    Compute nDCG@k, precision@k and recall@k for every k in ks, plus MRR,
+    for all queries at once.
+
+    rel:        (queries x depth) binary relevance matrix, see relevance_matrix()
+    n_relevant: (queries,) number of rated relevant documents per query
+
+    Returns { "ndcg@10": array(queries), "recall@3": array(queries), ..., "mrr": array(queries) }.
+    nDCG uses the same gain and ideal ranking as the _rank_eval "dcg" metric
+    with normalize=true, so ndcg@k matches its metric_score.
+    """
+    n_queries, depth = rel.shape
+    n_relevant = np.asarray(n_relevant, dtype=np.float64)
+    ranks = np.arange(depth)
+
+    discounts = 1.0 / np.log2(ranks + 2)
+    dcg = np.cumsum(rel * discounts, axis=1)
+
+    ## the ideal ranking puts every relevant doc first
+    ideal = (ranks[None, :] < n_relevant[:, None]).astype(np.float64)
+    idcg = np.cumsum(ideal * discounts, axis=1)
+
+    hits = np.cumsum(rel, axis=1)
+
+    scores = {}
+    for k in ks:
+        col = min(k, depth) - 1
+        scores[f"ndcg@{k}"] = np.divide(dcg[:, col], idcg[:, col], out=np.zeros(n_queries), where=idcg[:, col] > 0)
+        scores[f"precision@{k}"] = hits[:, col] / k
+        scores[f"recall@{k}"] = np.divide(hits[:, col], n_relevant, out=np.zeros(n_queries), where=n_relevant > 0)
+
+    ## reciprocal rank of the first relevant hit, 0 when none was retrieved
+    found = rel.any(axis=1)
+    first_hit = rel.argmax(axis=1)
+    scores["mrr"] = np.where(found, 1.0 / (first_hit + 1), 0.0)
+
+    return scores
@@ -0,0 +1,109 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+## Marks the end of the stream on a stage queue
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of an AsyncPipeline.
+
+    `fn` is a plain (blocking) callable that is run on a worker thread:
+      - batch_size == 1: fn(item) -> new item
+      - batch_size  > 1: fn([items]) -> [new items]
+    Batched stages take whatever is already queued (up to batch_size)
+    instead of waiting for a full batch.
+    """
+    def __init__(self, name: str, fn, concurrency: int = 1, batch_size: int = 1):
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+
+class AsyncPipeline:
+    """
+    Runs items through a chain of stages, each with its own bounded worker
+    pool and bounded input queue, so later stages start working as soon as
+    the first items come out of the earlier ones.
+
+    Output order is completion order; callers that need a stable order
+    should carry their own position along in the items.
+    """
+    def __init__(self, stages: list, queue_size: int = 100):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, items) -> list:
+        """
+        Blocking entry point: run the pipeline to completion and return the outputs.
+        """
+        return asyncio.run(self.run_async(items))
+
+    async def run_async(self, items) -> list:
+        ## one bounded input queue per stage, plus an unbounded one for the results
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages] + [asyncio.Queue()]
+        outputs = []
+
+        async def produce():
+            for item in items:
+                await queues[0].put(item)
+            await queues[0].put(_DONE)
+
+        async def collect(in_q):
+            while True:
+                item = await in_q.get()
+                if item is _DONE:
+                    return
+                outputs.append(item)
+
+        ## sized so every stage can have all of its workers busy at once
+        executor = ThreadPoolExecutor(max_workers=sum(stage.concurrency for stage in self.stages))
+
+        tasks = [asyncio.create_task(produce())]
+        for ix, stage in enumerate(self.stages):
+            tasks.append(asyncio.create_task(self._run_stage(stage, queues[ix], queues[ix + 1], executor)))
+        tasks.append(asyncio.create_task(collect(queues[-1])))
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            ## One stage failed, stop the rest instead of leaving them blocked on their queues
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return outputs
+
+    async def _run_stage(self, stage: Stage, in_q: asyncio.Queue, out_q: asyncio.Queue, executor):
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while True:
+                item = await in_q.get()
+                if item is _DONE:
+                    ## put it back so the sibling workers see it too
+                    in_q.put_nowait(_DONE)
+                    return
+
+                if stage.batch_size == 1:
+                    await out_q.put(await loop.run_in_executor(executor, stage.fn, item))
+                    continue
+
+                batch = [item]
+                while len(batch) < stage.batch_size and not in_q.empty():
+                    item = in_q.get_nowait()
+                    if item is _DONE:
+                        in_q.put_nowait(_DONE)
+                        break
+                    batch.append(item)
+
+                for result in await loop.run_in_executor(executor, stage.fn, batch):
+                    await out_q.put(result)
+
+        await asyncio.gather(*[worker() for _ in range(stage.concurrency)])
+        await out_q.put(_DONE)
@@ -1,97 +1,103 @@
-import json
-import os
-import atexit
 import hashlib
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-CACHE_FILE_PATH = "query_transform_cache.json"
-MAX_CACHE_SIZE = 1000  # Adjust to your desired capacity
+from utility.util_cache import make_cache
+from utility.util_cache_store import CACHE_DB_PATH
+from utility.util_llm import LLMError
+
+LEGACY_CACHE_FILE_PATH = "query_transform_cache.json"  # imported into the database once
+TRANSFORM_BATCH_SIZE = 100    # questions rewritten per batched LLM request
+TRANSFORM_BATCH_WORKERS = 4   # batched requests in flight at once (LLMUtil keeps them under the rate limits)
 
 
 class QueryTransformCache:
     """
-    A simple LRU cache for storing (prompt + question) -> LLM transform results.
-    Persists and loads its state from disk as JSON.
+    A cache for storing (prompt + question) -> LLM transform results.
+    Entries live in the "query_transform" namespace of the tiered cache
+    (memory, then the shared SQLite database), with the budgets and TTL set
+    in util_cache.CACHE_CONFIG. Nothing is read until the first lookup, so
+    importing a strategy stays cheap. Concurrent misses on the same prompt
+    and question share one LLM call.
     """
-    def __init__(self, cache_file_path: str = CACHE_FILE_PATH, max_size: int = MAX_CACHE_SIZE):
+    def __init__(self, cache_file_path: str = CACHE_DB_PATH):
         self.cache_file_path = cache_file_path
-        self.max_size = max_size
-        self.cache = OrderedDict()  # key=hash, value={ 'prompt', 'question', 'answer' }
-        
-        # Load cache from disk on startup
-        self._load_from_disk()
-
-        # Register exit handler to persist cache on program exit
-        atexit.register(self._persist_to_disk)
+        # key=hash, value={ 'prompt', 'question', 'answer' }
+        self.cache = make_cache("query_transform", cache_file_path, legacy_json_path=LEGACY_CACHE_FILE_PATH)
 
     def transform_query(self, question: str, prompt: str, llm_util) -> str:
         """
         Return a cached transform if available; otherwise call the LLM,
         cache the result, and return it.
         """
-        cache_key = self._make_key(prompt, question)
-
-        # LRU Cache Check
-        if cache_key in self.cache:
-            # print("\t\tCache Hit")
-            # Move to end (most recently used)
-            self.cache.move_to_end(cache_key, last=True)
-            return self.cache[cache_key]["answer"]
-        else:
-            # print("\t\tCache Miss")
+        def load():
             # Generate a new answer via LLM
-            answer = llm_util.transform_query(system_prompt=prompt, user_query=question)
-
-            # Insert into cache
-            self.cache[cache_key] = {
-                "prompt": prompt,
-                "question": question,
-                "answer": answer
-            }
-            self.cache.move_to_end(cache_key, last=True)
+            return self._entry(prompt, question, llm_util.transform_query(system_prompt=prompt, user_query=question))
 
-            # Enforce max size (LRU eviction)
-            if len(self.cache) > self.max_size:
-                self.cache.popitem(last=False)  # pop the least recently used item
+        return self.cache.get_or_load(self._make_key(prompt, question), load)["answer"]
 
-            return answer
-
-    def _make_key(self, prompt: str, question: str) -> str:
+    async def transform_query_async(self, question: str, prompt: str, llm_util) -> str:
         """
-        Create a repeatable hash from the prompt + question.
+        transform_query for asyncio callers, through llm_util.transform_query_async.
         """
-        raw_text = f"{prompt}||{question}"
-        return hashlib.sha256(raw_text.encode("utf-8")).hexdigest()
+        async def load():
+            answer = await llm_util.transform_query_async(system_prompt=prompt, user_query=question)
+            return self._entry(prompt, question, answer)
+
+        entry = await self.cache.get_or_load_async(self._make_key(prompt, question), load)
+        return entry["answer"]
 
-    def _load_from_disk(self):
+    def transform_queries(self, questions: list, prompt: str, llm_util, batch_size: int = TRANSFORM_BATCH_SIZE,
+                          workers: int = TRANSFORM_BATCH_WORKERS) -> list:
         """
-        Load the cache state from disk (JSON) if it exists.
+        Transforms of many questions sharing one prompt. The uncached ones
+        are rewritten batch_size at a time in single LLM requests
+        (llm_util.transform_queries); a question a batch has no rewrite for
+        falls back to its own transform_query call. Every new rewrite is
+        cached. Returns the transforms in the order of questions.
         """
-        if os.path.isfile(self.cache_file_path):
+        answers = {}
+        missing = []
+        for question in dict.fromkeys(questions):
+            entry = self.cache.get(self._make_key(prompt, question))
+            if entry is not None:
+                answers[question] = entry["answer"]
+            else:
+                missing.append(question)
+
+        def transform_batch(batch: list) -> dict:
             try:
-                with open(self.cache_file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                # Convert the loaded dictionary into an OrderedDict
-                self.cache = OrderedDict(data)
-            except Exception as e:
-                print(f"[QueryTransformCache] Warning: Could not load cache from disk: {e}")
-                self.cache = OrderedDict()
-        else:
-            # No cache file yet
-            self.cache = OrderedDict()
-
-    def _persist_to_disk(self):
+                rewrites = llm_util.transform_queries(system_prompt=prompt, user_queries=batch)
+            except LLMError as e:
+                print(f"[QueryTransformCache] Batch of {len(batch)} failed, transforming one by one: {e}")
+                rewrites = [None] * len(batch)
+            transformed = {}
+            for question, rewrite in zip(batch, rewrites):
+                if rewrite is None:
+                    transformed[question] = self.transform_query(question, prompt, llm_util)
+                else:
+                    self.cache.put(self._make_key(prompt, question), self._entry(prompt, question, rewrite))
+                    transformed[question] = rewrite
+            return transformed
+
+        batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for transformed in executor.map(transform_batch, batches):
+                answers.update(transformed)
+        return [answers[question] for question in questions]
+
+    def _entry(self, prompt: str, question: str, answer: str) -> dict:
+        return {
+            "prompt": prompt,
+            "question": question,
+            "answer": answer
+        }
+
+    def _make_key(self, prompt: str, question: str) -> str:
         """
-        Write the current cache state to disk in JSON format.
-        Called automatically on interpreter exit (via `atexit`).
+        Create a repeatable hash from the prompt + question.
         """
-        try:
-            # Convert our OrderedDict to a regular dict for JSON dumping
-            data_to_save = dict(self.cache)
-            with open(self.cache_file_path, "w", encoding="utf-8") as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[QueryTransformCache] Error: Could not persist cache to disk: {e}")
+        raw_text = f"{prompt}||{question}"
+        return hashlib.sha256(raw_text.encode("utf-8")).hexdigest()
 
 
 # Singleton-like pattern, if you prefer a single instance:
@@ -105,9 +111,17 @@ def transform_query(question: str, prompt: str, llm_util):
     return transform_cache.transform_query(question, prompt, llm_util)
 
 
+def transform_queries(questions: list, prompt: str, llm_util) -> list:
+    return transform_cache.transform_queries(questions, prompt, llm_util)
+
+
+async def transform_query_async(question: str, prompt: str, llm_util):
+    return await transform_cache.transform_query_async(question, prompt, llm_util)
+
+
 def close_cache():
     """
-    If you want to manually persist the cache instead of only at exit,
-    you can call this function to persist right away.
+    Close this thread's connection to the cache database. Entries are
+    already on disk; the next lookup reopens it.
     """
-    transform_cache._persist_to_disk()
+    transform_cache.cache.tiers[-1].close()
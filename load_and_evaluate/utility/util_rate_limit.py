@@ -0,0 +1,39 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: `rate` tokens are added per second, up to
+    `capacity`. Callers take tokens before doing work and wait when the
+    bucket is empty. Usable from threads (acquire) and asyncio (acquire_async).
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """
+        Take `tokens` from the bucket (it may go negative) and return how long
+        the caller has to wait until they are actually available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1.0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
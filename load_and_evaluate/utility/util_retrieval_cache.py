@@ -0,0 +1,381 @@
+import json
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = os.getenv("ES_RETRIEVAL_CACHE_DIR")  # optional on-disk tier, memory only when unset
+MAX_RANKINGS = 100000  # ranked id lists are small, keep plenty
+MAX_SOURCES = 5000     # documents can be tens of KB each
+RANK_WINDOW_SIZE = 10  # rrf / knn window when a query doesn't set one (the Elasticsearch default size), see build_retrieval_request
+KNN_CANDIDATE_FACTOR = 1.5  # knn num_candidates per k, Elasticsearch's own default ratio
+
+
+class RetrievalCache:
+    """
+    Caches Elasticsearch retrieval results so the rank eval phase, the deep
+    eval phase and repeated runs don't send the same query DSL twice.
+
+    Three LRU maps are kept:
+      rankings: sha256(index || canonical query DSL) -> ranked hit ids and scores
+      passages: sha256(index || canonical query DSL and highlight) -> the same, plus
+                each hit's inner hit chunks and highlight fragments (they depend on the query)
+      sources:  sha256(index || doc id)              -> the _source fields fetched so far
+
+    A search whose ranking is cached only needs the missing _source fields,
+    which are fetched by id with _mget (no query, inference or reranking).
+    When a cache_dir is given every entry is also written there as its own
+    JSON file and read back on a memory miss.
+    """
+    def __init__(self, cache_dir: str = CACHE_DIR, max_rankings: int = MAX_RANKINGS, max_sources: int = MAX_SOURCES):
+        self.cache_dir = cache_dir
+        self.max_rankings = max_rankings
+        self.max_sources = max_sources
+        self.rankings = OrderedDict()  # key -> { 'size', 'hits': [{'_id', '_score'}] }
+        self.passages = OrderedDict()  # key -> { 'size', 'hits': [{'_id', '_score', 'passages'}] }
+        self.sources = OrderedDict()   # key -> { 'fields', 'source' }
+        self.lock = threading.Lock()
+
+    def search(self, es, index_name: str, body: dict, size: int = 10, source_fields: list = None, source_limit: int = None) -> list:
+        """
+        Return the top `size` hits of `body` against index_name as
+        [{'_id', '_score', '_source': {field: value}}], with _source limited
+        to source_fields (ids and scores only when source_fields is empty).
+        Only the first `source_limit` hits get a _source when it is set.
+        """
+        source_fields = list(source_fields or [])
+        ranking_key = self._ranking_key(index_name, body)
+        ranking = self._get(self.rankings, "rankings", ranking_key)
+
+        if ranking is None or ranking["size"] < size:
+            ## Cold: one search fills the ranking and the sources of its hits
+            response = es.search(index=index_name, body=build_retrieval_request(body, size, source_fields))
+            hits = response["hits"]["hits"]
+            self._put(self.rankings, "rankings", ranking_key, {
+                "size": size,
+                "hits": [{"_id": hit["_id"], "_score": hit["_score"]} for hit in hits]
+            }, self.max_rankings)
+            for hit in hits:
+                if source_fields:
+                    self._store_source(index_name, hit["_id"], source_fields, hit.get("_source", {}))
+            ranked_ids = [hit["_id"] for hit in hits]
+            scores = [hit["_score"] for hit in hits]
+        else:
+            hits = ranking["hits"][:size]
+            ranked_ids = [hit["_id"] for hit in hits]
+            scores = [hit["_score"] for hit in hits]
+
+        sources = self.get_sources(es, index_name, ranked_ids[:source_limit], source_fields) if source_fields else {}
+        return [
+            {"_id": doc_id, "_score": score, "_source": sources.get(doc_id, {})}
+            for doc_id, score in zip(ranked_ids, scores)
+        ]
+
+    def search_passages(self, es, index_name: str, body: dict, size: int = 10, highlight: dict = None) -> list:
+        """
+        Return the top `size` hits of `body` as [{'_id', '_score', 'passages'}],
+        the passages being the texts of the hit's inner hits and highlight
+        fragments, in the order Elasticsearch returned them. No _source is
+        fetched, only what the body's inner_hits / the highlight ask for.
+
+        highlight doesn't change the ranking, so the ranking is cached under
+        the body alone and shared with search / msearch.
+        """
+        key = self._passages_key(index_name, body, highlight)
+        entry = self._get(self.passages, "passages", key)
+        if entry is None or entry["size"] < size:
+            response = es.search(index=index_name, body=passages_request(body, size, highlight))
+            entry = self._store_passages(index_name, body, highlight, size, response["hits"]["hits"])
+        return entry["hits"][:size]
+
+    def msearch_passages(self, es, index_name: str, bodies: list, size: int = 10, highlight_of=None) -> int:
+        """
+        Fill the passages cache for many bodies with a single _msearch,
+        sending only the uncached ones. highlight_of(body) gives the
+        highlight search_passages would be called with. Searches that fail
+        are skipped (search_passages runs them again). Returns how many
+        were sent.
+        """
+        missing = []
+        for body in bodies:
+            highlight = highlight_of(body) if highlight_of else None
+            entry = self._get(self.passages, "passages", self._passages_key(index_name, body, highlight))
+            if entry is None or entry["size"] < size:
+                missing.append((body, highlight))
+        if not missing:
+            return 0
+
+        searches = []
+        for body, highlight in missing:
+            searches.append({"index": index_name})
+            searches.append(passages_request(body, size, highlight))
+        results = es.msearch(searches=searches)
+
+        for (body, highlight), response in zip(missing, results["responses"]):
+            if "error" in response:
+                print(f"Error in msearch against {index_name}: {response['error']}")
+                continue
+            self._store_passages(index_name, body, highlight, size, response["hits"]["hits"])
+        return len(missing)
+
+    def _store_passages(self, index_name: str, body: dict, highlight: dict, size: int, hits: list) -> dict:
+        entry = {
+            "size": size,
+            "hits": [{"_id": hit["_id"], "_score": hit["_score"], "passages": hit_passages(hit)} for hit in hits]
+        }
+        self._put(self.passages, "passages", self._passages_key(index_name, body, highlight), entry, self.max_rankings)
+        ranking_key = self._ranking_key(index_name, body)
+        ranking = self._get(self.rankings, "rankings", ranking_key)
+        if ranking is None or ranking["size"] < size:
+            self._put(self.rankings, "rankings", ranking_key, {
+                "size": size,
+                "hits": [{"_id": hit["_id"], "_score": hit["_score"]} for hit in hits]
+            }, self.max_rankings)
+        return entry
+
+    def msearch(self, es, index_name: str, bodies: list, size: int = 10) -> list:
+        """
+        Ranked hit ids for many query bodies, sending only the uncached ones
+        in a single _msearch. Searches that fail come back as None.
+        """
+        ranked_ids = [None] * len(bodies)
+        missing = []
+        for ix, body in enumerate(bodies):
+            ranking = self._get(self.rankings, "rankings", self._ranking_key(index_name, body))
+            if ranking is not None and ranking["size"] >= size:
+                ranked_ids[ix] = [hit["_id"] for hit in ranking["hits"][:size]]
+            else:
+                missing.append(ix)
+
+        if not missing:
+            return ranked_ids
+
+        searches = []
+        for ix in missing:
+            searches.append({"index": index_name})
+            searches.append(build_retrieval_request(bodies[ix], size))
+
+        results = es.msearch(searches=searches)
+
+        for ix, response in zip(missing, results["responses"]):
+            if "error" in response:
+                print(f"Error in msearch against {index_name}: {response['error']}")
+                continue
+            hits = response["hits"]["hits"]
+            self._put(self.rankings, "rankings", self._ranking_key(index_name, bodies[ix]), {
+                "size": size,
+                "hits": [{"_id": hit["_id"], "_score": hit["_score"]} for hit in hits]
+            }, self.max_rankings)
+            ranked_ids[ix] = [hit["_id"] for hit in hits]
+
+        return ranked_ids
+
+    def get_sources(self, es, index_name: str, doc_ids: list, source_fields: list) -> dict:
+        """
+        Return { doc_id: {field: value} } for doc_ids, fetching the documents
+        (or fields) that are not cached yet with one _mget.
+        """
+        sources = {}
+        missing = []
+        for doc_id in doc_ids:
+            entry = self._get(self.sources, "sources", self._source_key(index_name, doc_id))
+            if entry is not None and set(source_fields) <= set(entry["fields"]):
+                sources[doc_id] = {f: entry["source"][f] for f in source_fields if f in entry["source"]}
+            else:
+                missing.append(doc_id)
+
+        if missing:
+            response = es.mget(index=index_name, ids=missing, source_includes=source_fields)
+            for doc in response["docs"]:
+                if doc.get("found"):
+                    self._store_source(index_name, doc["_id"], source_fields, doc.get("_source", {}))
+                    sources[doc["_id"]] = {f: doc["_source"][f] for f in source_fields if f in doc["_source"]}
+
+        return sources
+
+    def _store_source(self, index_name: str, doc_id: str, source_fields: list, source: dict):
+        key = self._source_key(index_name, doc_id)
+        entry = self._get(self.sources, "sources", key)
+        if entry is not None:
+            ## keep what was fetched for other callers alongside the new fields
+            fields = sorted(set(entry["fields"]) | set(source_fields))
+            source = {**entry["source"], **source}
+        else:
+            fields = sorted(source_fields)
+        self._put(self.sources, "sources", key, {
+            "fields": fields,
+            "source": {f: source[f] for f in fields if f in source}
+        }, self.max_sources)
+
+    def _ranking_key(self, index_name: str, body: dict) -> str:
+        """
+        Hash of the index and a canonical (key-sorted, compact) dump of the query DSL.
+        """
+        canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(f"{index_name}||{canonical}".encode("utf-8")).hexdigest()
+
+    def _passages_key(self, index_name: str, body: dict, highlight: dict) -> str:
+        return self._ranking_key(index_name, {**body, "highlight": highlight} if highlight else body)
+
+    def _source_key(self, index_name: str, doc_id: str) -> str:
+        return hashlib.sha256(f"{index_name}||{doc_id}".encode("utf-8")).hexdigest()
+
+    def _get(self, cache: OrderedDict, kind: str, key: str):
+        with self.lock:
+            if key in cache:
+                cache.move_to_end(key, last=True)
+                return cache[key]
+
+        entry = self._load_from_disk(kind, key)
+        if entry is not None:
+            with self.lock:
+                cache[key] = entry
+                self._evict(cache, self.max_sources if kind == "sources" else self.max_rankings)
+        return entry
+
+    def _put(self, cache: OrderedDict, kind: str, key: str, entry: dict, max_size: int):
+        with self.lock:
+            cache[key] = entry
+            cache.move_to_end(key, last=True)
+            self._evict(cache, max_size)
+        self._persist_to_disk(kind, key, entry)
+
+    def _evict(self, cache: OrderedDict, max_size: int):
+        # Enforce max size (LRU eviction)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+    def _disk_path(self, kind: str, key: str) -> str:
+        return os.path.join(self.cache_dir, kind, key[:2], f"{key}.json")
+
+    def _load_from_disk(self, kind: str, key: str):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(kind, key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[RetrievalCache] Warning: Could not load {path}: {e}")
+            return None
+
+    def _persist_to_disk(self, kind: str, key: str, entry: dict):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(kind, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            ## write then rename so concurrent readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"[RetrievalCache] Error: Could not persist {path}: {e}")
+
+
+def build_retrieval_request(body: dict, size: int, source_fields: list = None, passages: bool = False) -> dict:
+    """
+    The search request for a strategy's query body, asking only for what
+    the caller reads:
+      size:             the hits it uses
+      _source:          just source_fields, nothing when there are none
+      inner_hits, highlight: kept only when the caller reads passages, they
+                        don't change the ranking
+      stored_fields:    none (hits carry only _id and _score) when nothing
+                        at all is read from the documents
+      track_total_hits: off, nobody reads the total and counting it stops
+                        shards from terminating early
+
+    Windows the query leaves to Elasticsearch are pinned to RANK_WINDOW_SIZE
+    (or size when larger): rrf and reranker rank_window_size, knn k and
+    num_candidates. They otherwise follow size, so reading fewer hits would
+    search fewer candidates and could change the top hits, and a cached
+    ranking would depend on which request filled it first.
+    """
+    request = _project(body, max(size, RANK_WINDOW_SIZE), passages)
+    if not passages:
+        request.pop("highlight", None)
+    request.update({"size": size, "_source": list(source_fields) if source_fields else False, "track_total_hits": False})
+    if not source_fields and not passages and not any(key in request for key in ("fields", "docvalue_fields", "script_fields")):
+        request["stored_fields"] = []
+    return request
+
+
+def passages_request(body: dict, size: int, highlight: dict = None) -> dict:
+    """
+    build_retrieval_request for passage reads, with the highlight (if any) added.
+    """
+    request = build_retrieval_request(body, size, passages=True)
+    if highlight:
+        request["highlight"] = highlight
+    return request
+
+
+def _project(node, window: int, passages: bool):
+    """
+    Copy of a query body with rank and knn windows pinned and, unless
+    passages are read, without inner_hits.
+    """
+    if isinstance(node, list):
+        return [_project(value, window, passages) for value in node]
+    if not isinstance(node, dict):
+        return node
+    projected = {key: _project(value, window, passages) for key, value in node.items()
+                 if passages or key != "inner_hits"}
+    for ranker in ("rrf", "text_similarity_reranker"):
+        if isinstance(projected.get(ranker), dict):
+            projected[ranker].setdefault("rank_window_size", window)
+    ## knn query, retriever or top level search (a list of them at the top level)
+    knns = projected.get("knn")
+    for knn in knns if isinstance(knns, list) else [knns]:
+        if isinstance(knn, dict) and "field" in knn:
+            knn.setdefault("k", window)
+            knn.setdefault("num_candidates", max(knn["k"], int(knn["k"] * KNN_CANDIDATE_FACTOR)))
+    return projected
+
+
+def has_inner_hits(body) -> bool:
+    if isinstance(body, dict):
+        return "inner_hits" in body or any(has_inner_hits(value) for value in body.values())
+    if isinstance(body, list):
+        return any(has_inner_hits(value) for value in body)
+    return False
+
+
+def hit_passages(hit: dict) -> list:
+    """
+    Texts of a hit's inner hits (e.g. the matching semantic_text chunks)
+    followed by its highlight fragments, without duplicates.
+    """
+    passages = []
+    for inner in hit.get("inner_hits", {}).values():
+        for inner_hit in inner["hits"]["hits"]:
+            passages.extend(_texts(inner_hit.get("_source") or {}))
+    for fragments in hit.get("highlight", {}).values():
+        passages.extend(fragments)
+    return list(dict.fromkeys(p.strip() for p in passages if p and p.strip()))
+
+
+def _texts(source) -> list:
+    ## an inner hit's _source is the nested object, e.g. { "text": ... } for a
+    ## semantic_text chunk, possibly under its path when it was filtered
+    if isinstance(source, str):
+        return [source]
+    if isinstance(source, list):
+        return [text for item in source for text in _texts(item)]
+    if isinstance(source, dict):
+        if isinstance(source.get("text"), str):
+            return [source["text"]]
+        return [text for value in source.values() for text in _texts(value)]
+    return []
+
+
+# Shared instance used by search_to_context, the evaluation phases and the app
+retrieval_cache = RetrievalCache()
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    return retrieval_cache
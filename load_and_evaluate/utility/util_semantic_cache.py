@@ -0,0 +1,233 @@
+import base64
+import hashlib
+import random
+import re
+import threading
+
+import numpy as np
+
+from utility.util_cache import register_cache
+from utility.util_cache_store import SqliteCacheStore, CACHE_DB_PATH
+from utility.util_llm_rag_cache import passage_id
+
+SEMANTIC_THRESHOLD = 0.92     # cosine similarity a prior query needs to answer for a new one
+SEMANTIC_MAX_ENTRIES = 50000  # answers kept per database, least recently used evicted first
+AUDIT_RATE = 0.05             # share of hits re-checked against a fresh retrieval
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Deterministic local stand-in for an embedding model: word and character
+    trigram counts hashed into a fixed size vector. Needs no API key and
+    gives the same vector on every machine, so thresholds and tests are
+    reproducible. It only catches rewordings that share most of their words.
+    """
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: list) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = TOKEN_PATTERN.findall(text.lower())
+            features = words + [f"#{word[i:i + 3]}" for word in words for i in range(max(len(word) - 2, 1))]
+            for feature in features:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vectors
+
+
+class OpenAIEmbedder:
+    """
+    Embeddings from the OpenAI API (uses the key set up by LLMUtil).
+    """
+    def __init__(self, model: str = "text-embedding-3-small"):
+        self.model = model
+        self.name = f"openai-{model}"
+
+    def embed(self, texts: list) -> np.ndarray:
+        import openai
+        response = openai.embeddings.create(model=self.model, input=texts)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+class SemanticAnswerCache:
+    """
+    Optional cache in front of retrieval and generation that answers a
+    query with the answer of a previously seen, similar enough query.
+
+    Queries are embedded with a pluggable embedder (anything with a `name`
+    and embed(texts) -> array). Each scope (e.g. a strategy) keeps an
+    in-memory NumPy matrix of unit vectors, so a lookup is a single matrix
+    vector product; at a few hundred thousand queries an ANN index (faiss,
+    hnswlib) would slot in behind _nearest. Answers and vectors persist in
+    the "semantic" namespace of the shared cache database.
+
+    Answers are only reused under the same version (e.g. the prompt
+    template and model, see util_llm_rag_cache.answer_version): it is part
+    of the key and of the scope, so another version is a miss.
+
+    A hit can be wrong: two questions can be close in embedding space and
+    still need different documents. A sample of hits (audit_rate) is
+    re-checked by running retrieval anyway; if the passages (document ids
+    and content hashes) differ from the ones the cached answer was
+    generated from, the hit is counted as a false hit and the answer is
+    generated fresh. The false hit rate shows
+    up in cache_stats() and is the number to tune the threshold by.
+    """
+    def __init__(self, embedder=None, threshold: float = SEMANTIC_THRESHOLD, audit_rate: float = AUDIT_RATE,
+                 db_path: str = CACHE_DB_PATH, max_entries: int = SEMANTIC_MAX_ENTRIES):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.namespace = "semantic"
+        self.store = SqliteCacheStore(self.namespace, db_path, max_entries=max_entries)
+        self.indexes = None  # scope -> (keys, { key: row }, matrix), loaded on first use
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0, "audited": 0, "false_hits": 0}
+        self.similarity_sum = 0.0
+        register_cache(self)
+
+    def answer(self, scope: str, query: str, retrieve, generate, version: str = "") -> str:
+        """
+        Answer query within scope. retrieve(query) -> passages and
+        generate(query, passages) -> answer are only called on a miss (or
+        to audit a hit).
+        """
+        scope = f"{scope}||{version}"
+        ## the query itself first (no embedding needed), then its nearest neighbours
+        vector = None
+        match = (self._key(scope, query), 1.0)
+        entry = self.store.get(match[0])
+        if entry is None:
+            vector = self._embed(query)
+            for match in self._nearest(scope, vector):
+                entry = self.store.get(match[0])
+                if entry is not None:
+                    break
+                ## evicted from the store since it was indexed
+                with self.lock:
+                    self._remove(scope, match[0])
+        if entry is not None:
+            entry = entry[0]
+            with self.lock:
+                self.counters["hits"] += 1
+                self.similarity_sum += match[1]
+            if random.random() >= self.audit_rate:
+                return entry["answer"]
+
+            passages = retrieve(query)
+            with self.lock:
+                self.counters["audited"] += 1
+            if _passage_ids(passages) == entry.get("passages"):
+                return entry["answer"]
+            with self.lock:
+                self.counters["false_hits"] += 1
+            return self._generate(scope, query, vector, passages, generate)
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return self._generate(scope, query, vector, retrieve(query), generate)
+
+    def stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+            similarity_sum = self.similarity_sum
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "coalesced": 0,
+            "expirations": 0,
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            "false_hit_rate": counters["false_hits"] / counters["audited"] if counters["audited"] else 0.0,
+            "mean_hit_similarity": similarity_sum / counters["hits"] if counters["hits"] else 0.0,
+            "threshold": self.threshold,
+            "tiers": {self.store.name: {"entries": len(self.store), "bytes": self.store.size_bytes()}},
+        }
+
+    def _generate(self, scope: str, query: str, vector: np.ndarray, passages: list, generate) -> str:
+        answer = generate(query, passages)
+        if vector is None:
+            vector = self._embed(query)
+        key = self._key(scope, query)
+        evicted = self.store.put(key, {
+            "embedder": self.embedder.name,
+            "scope": scope,
+            "query": query,
+            "vector": base64.b64encode(vector.tobytes()).decode("ascii"),
+            "passages": _passage_ids(passages),
+            "answer": answer,
+        })
+        with self.lock:
+            self.counters["puts"] += 1
+            self.counters["evictions"] += evicted
+            self._add(scope, key, vector)
+        return answer
+
+    def _key(self, scope: str, query: str) -> str:
+        return f"{self.embedder.name}||{scope}||{query}"
+
+    def _embed(self, query: str) -> np.ndarray:
+        vector = self.embedder.embed([query])[0].astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _nearest(self, scope: str, vector: np.ndarray) -> list:
+        """
+        [(key, similarity)] of the prior queries above the threshold, most
+        similar first.
+        """
+        with self.lock:
+            self._load()
+            keys, _, matrix = self.indexes.get(scope, ([], {}, None))
+            if not keys:
+                return []
+            similarities = matrix[:len(keys)] @ vector
+            above = np.flatnonzero(similarities >= self.threshold)
+            return [(keys[ix], float(similarities[ix])) for ix in above[np.argsort(-similarities[above], kind="stable")]]
+
+    def _load(self):
+        """
+        Build the per-scope indexes from the store, once per process.
+        """
+        if self.indexes is not None:
+            return
+        self.indexes = {}
+        for key, value in self.store.items(prefix=f"{self.embedder.name}||"):
+            ## vectors of another embedder aren't comparable, so only this one's are loaded
+            self._add(value["scope"], key, np.frombuffer(base64.b64decode(value["vector"]), dtype=np.float32))
+
+    def _add(self, scope: str, key: str, vector: np.ndarray):
+        ## rows are appended into a matrix that doubles when full
+        self._load()
+        keys, rows, matrix = self.indexes.get(scope, ([], {}, None))
+        if key in rows:
+            matrix[rows[key]] = vector
+            return
+        if matrix is None:
+            matrix = np.zeros((64, len(vector)), dtype=np.float32)
+        elif len(keys) == len(matrix):
+            matrix = np.vstack([matrix, np.zeros_like(matrix)])
+        matrix[len(keys)] = vector
+        rows[key] = len(keys)
+        keys.append(key)
+        self.indexes[scope] = (keys, rows, matrix)
+
+    def _remove(self, scope: str, key: str):
+        ## the last row moves into the freed one
+        keys, rows, matrix = self.indexes.get(scope, ([], {}, None))
+        if key not in rows:
+            return
+        row, last = rows.pop(key), len(keys) - 1
+        if row != last:
+            matrix[row] = matrix[last]
+            keys[row] = keys[last]
+            rows[keys[row]] = row
+        keys.pop()
+
+
+def _passage_ids(passages: list) -> list:
+    return ["@".join(passage_id(passage)) for passage in passages]
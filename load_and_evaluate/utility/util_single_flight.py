@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import weakref
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key across threads: the first
+    caller runs the function, callers arriving while it runs wait and get
+    its result. An error is raised to every waiter of that call but not
+    remembered, so the next call tries again.
+    """
+    def __init__(self):
+        self.calls = {}  # key -> _Call in flight
+        self.shared = 0  # calls answered by another caller's flight
+        self.lock = threading.Lock()
+
+    def do(self, key: str, fn, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines. The first caller's coroutine runs as its
+    own task and every caller, the first included, awaits it through a
+    shield: a caller that is cancelled stops waiting without cancelling the
+    call the others are waiting on. Calls are coalesced per event loop.
+    """
+    def __init__(self):
+        self.calls = weakref.WeakKeyDictionary()  # loop -> { key: task in flight }
+        self.shared = 0
+
+    async def do(self, key: str, coro_fn, *args, **kwargs):
+        calls = self.calls.setdefault(asyncio.get_running_loop(), {})
+        task = calls.get(key)
+        if task is None:
+            task = calls[key] = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            task.add_done_callback(lambda done: _finish(calls, key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+def _finish(calls: dict, key: str, task: asyncio.Task):
+    if calls.get(key) is task:
+        del calls[key]
+    if not task.cancelled():
+        task.exception()  # retrieved, even if every caller was cancelled
@@ -0,0 +1,103 @@
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from tqdm import tqdm
+
+from utility.util_dataset import partition_files, iter_records, write_partition
+
+## A stage is a plain function record -> record, or None to drop the record.
+## Stages run in order on every record, in one streaming pass per partition,
+## and may change the record in place: records are decoded fresh for every
+## row, so nothing is shared and nothing needs copying. Stages must be
+## module level functions (or functools.partial of one) so worker processes
+## can unpickle them.
+
+
+class Filter:
+    """
+    Filter stage: keeps the records a predicate accepts, drops the rest.
+    """
+    def __init__(self, predicate):
+        self.predicate = predicate
+        self.__name__ = f"Filter({stage_name(predicate)})"
+
+    def __call__(self, record):
+        return record if self.predicate(record) else None
+
+
+def stage_name(stage) -> str:
+    func = getattr(stage, "func", stage)  # functools.partial
+    return getattr(func, "__name__", repr(func))
+
+
+def apply_stages(stages: list, records, dropped: Counter):
+    """
+    Stream records through the stages, counting drops per stage.
+    """
+    for record in records:
+        for stage in stages:
+            record = stage(record)
+            if record is None:
+                dropped[stage_name(stage)] += 1
+                break
+        else:
+            yield record
+
+
+def transform_partition(stages: list, in_path: str, out_path: str) -> tuple:
+    """
+    Run the stages over one partition into out_path (which may be in_path).
+    Runs in a worker process. Returns (records written, drops per stage).
+    """
+    dropped = Counter()
+    tmp_path = f"{out_path}.tmp"
+    count = write_partition(apply_stages(stages, iter_records([in_path]), dropped), tmp_path)
+    os.replace(tmp_path, out_path)
+    return count, dropped
+
+
+def run_transform(stages: list, in_folder: str, out_folder: str = None, workers: int = None) -> tuple:
+    """
+    Apply the stages to every partition in in_folder, one partition per
+    worker process, writing partitions of the same name to out_folder
+    (in_folder itself when not given). Returns (records written, drops per stage).
+    """
+    out_folder = Path(out_folder or in_folder)
+    out_folder.mkdir(parents=True, exist_ok=True)
+    files = partition_files(in_folder)
+    print(f"Transforming {len(files)} partitions with: {', '.join(stage_name(s) for s in stages)}")
+
+    total = 0
+    dropped = Counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [
+            pool.submit(transform_partition, stages, str(path), str(out_folder / Path(path).with_suffix(".parquet").name))
+            for path in files
+        ]
+        for future in tqdm(futures):
+            count, partition_dropped = future.result()
+            total += count
+            dropped.update(partition_dropped)
+
+    print(f"Wrote {total} records to {out_folder}, dropped: {dict(dropped) or 'none'}")
+    return total, dropped
+
+
+def select_partition(predicate, path: str, columns: list = None) -> list:
+    return [record for record in iter_records([path], columns) if predicate(record)]
+
+
+def select_records(predicate, in_folder: str, columns: list = None, workers: int = None) -> list:
+    """
+    Records (projected to columns) matching a predicate, scanning the
+    partitions in parallel.
+    """
+    files = partition_files(in_folder)
+    selected = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(select_partition, predicate, str(path), columns) for path in files]
+        for future in tqdm(futures):
+            selected.extend(future.result())
+    return selected